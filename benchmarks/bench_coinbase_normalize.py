@@ -0,0 +1,80 @@
+# Benchmark for Coinbase transaction normalization on a synthetic account
+#
+# Compares the indexed off-blockchain buy lookup against the previous linear
+# scan of the account's buys for every matching transaction:
+#
+#   python benchmarks/bench_coinbase_normalize.py [-t TRANSACTIONS] [-b BUYS]
+
+import argparse, os, sys, time, uuid, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import crypto_export
+
+class LinearRecordIndex(crypto_export.RecordIndex):
+    # previous behavior: scan every record of the resource for each lookup
+    def get(self, resource, record_id):
+        for record in self.account[resource]['data']:
+            if record['id'] == record_id:
+                return record
+        return None
+
+def synthetic_account(transactions, buys, seed=1):
+    rng = random.Random(seed)
+    account = { 'id': str(uuid.UUID(int=rng.getrandbits(128))), 'currency': 'BTC' }
+    account['buys'] = { 'data': [] }
+    for i in range(buys):
+        account['buys']['data'].append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'status': 'completed',
+            'created_at': '2017-01-01T00:00:00Z',
+            'amount': { 'amount': '0.01000000', 'currency': 'BTC' },
+            'total': { 'amount': '10.99', 'currency': 'USD' },
+            'subtotal': { 'amount': '10.00', 'currency': 'USD' },
+            'user_reference': 'REF%d' % i })
+    account['sells'] = { 'data': [] }
+    account['deposits'] = { 'data': [] }
+    account['withdrawals'] = { 'data': [] }
+
+    # every transaction is an off-blockchain deposit referencing a random buy, the worst case for lookups
+    account['transactions'] = { 'data': [] }
+    for i in range(transactions):
+        buy = rng.choice(account['buys']['data'])
+        account['transactions']['data'].append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'status': 'completed',
+            'type': 'send',
+            'created_at': '2017-01-01T00:00:00Z',
+            'amount': { 'amount': '0.01000000', 'currency': 'BTC' },
+            'native_amount': { 'amount': '10.00', 'currency': 'USD' },
+            'from': { 'resource': 'user' },
+            'network': { 'status': 'off_blockchain' },
+            'buy': { 'resource_path': '/v2/accounts/%s/buys/%s' % (account['id'], buy['id']) } })
+    return { 'data': [account] }
+
+def timed_normalize(coinbase_accounts, index_class):
+    crypto_export.RecordIndex = index_class
+    entries = crypto_export.RecordStore()
+    start = time.perf_counter()
+    crypto_export.normalize_coinbase_accounts(coinbase_accounts, entries)
+    return time.perf_counter() - start, [entries.row(i) for i in range(len(entries))]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--transactions", help="Number of synthetic transactions, default is 50000", type=int, default=50000)
+    parser.add_argument("-b", "--buys", help="Number of synthetic buys, default is 5000", type=int, default=5000)
+    args = parser.parse_args()
+
+    coinbase_accounts = synthetic_account(args.transactions, args.buys)
+    indexed_class = crypto_export.RecordIndex
+    indexed_time, indexed_entries = timed_normalize(coinbase_accounts, indexed_class)
+    linear_time, linear_entries = timed_normalize(coinbase_accounts, LinearRecordIndex)
+    crypto_export.RecordIndex = indexed_class
+
+    if indexed_entries != linear_entries:
+        print("Indexed and linear lookups produced different rows")
+        sys.exit(1)
+
+    print("%d transactions, %d buys" % (args.transactions, args.buys))
+    print("linear scan:  %8.3f s" % linear_time)
+    print("indexed:      %8.3f s" % indexed_time)
+    print("speedup:      %8.1fx" % (linear_time / indexed_time))
@@ -0,0 +1,234 @@
+# Stage benchmarks for the export pipeline on synthetic or recorded exchange data
+#
+# Times the fetch (through stub API clients, see fixtures.py), normalize, sort
+# and write stages for Coinbase and GDAX data, and measures the peak memory
+# allocated by each stage. Timings are the best of several runs with garbage
+# collection disabled, like timeit, and are compared as multiples of a fixed
+# calibration workload timed the same way, so that results from a faster or
+# busier machine stay comparable. The fetch stage measures the API work alone;
+# the throttled fetch stage runs it once on up to 5000 records per cache with
+# every stub request waiting for the exchange's default rate limiter, like a
+# real run, and is compared in plain seconds since that time is spent waiting.
+# Results are compared with a stored baseline for the same parameters: any
+# stage using more memory than the baseline allows for is a regression (exit
+# status 1), while slower stages are only reported unless --strict-time is
+# given:
+#
+#   python benchmarks/bench_export.py [-n RECORDS] [-l LATENCY] [-w WORKERS] [-r REPEAT]
+#   python benchmarks/bench_export.py --save-baseline
+#
+# Use -c PREFIX to benchmark recorded cache files (e.g. from a --local run, or
+# written by fixtures.py) instead of generating synthetic data.
+
+import argparse, os, sys, gc, json, time, random, tempfile, tracemalloc, configparser
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import crypto_export
+import fixtures
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# synthetic records per cache file for the throttled fetch stages (fewer if -n is smaller)
+throttled_records = 5000
+
+def quiet(message):
+    pass
+
+def raw_rows(entries):
+    # unformatted export records of a RecordStore, as passed to ExportWriter.append()
+    values = entries.values
+    for i in range(len(entries)):
+        yield (entries.dates[i], entries.buy_amounts[i], values[entries.buy_currencies[i]], entries.sell_amounts[i], values[entries.sell_currencies[i]],
+               entries.fee_amounts[i], values[entries.fee_currencies[i]], entries.trade_ids[i], entries.comments[i], values[entries.types[i]], values[entries.exchanges[i]])
+
+def fetch_coinbase(data, latency, workers, limiter=None):
+    client = fixtures.StubCoinbaseClient(data['coinbase_accounts'], latency, limiter)
+    return crypto_export.fetch_coinbase_accounts(client, workers, log=quiet), client.requests
+
+def fetch_gdax(data, latency, workers, limiter=None):
+    # same requests as GdaxExchange.fetch() makes for a full download
+    client = fixtures.StubGdaxClient()
+    session = fixtures.StubGdaxSession(data['gdax_accounts'], data['gdax_fills'], latency=latency, limiter=limiter)
+    r, products = crypto_export.gdax_get(client, session, '/products')
+    r, gdax_accounts = crypto_export.gdax_get(client, session, '/accounts')
+    for account in gdax_accounts:
+        paginate = lambda after: crypto_export.paginate_gdax(client, session, '/accounts/%s/ledger' % account['id'], {}, after)
+        account['history'] = crypto_export.fetch_pages(paginate)
+    gdax_fills = crypto_export.fetch_gdax_fills(client, session, workers, products, crypto_export.gdax_held_currencies(gdax_accounts), log=quiet)
+    return { 'gdax_accounts': gdax_accounts, 'gdax_fills': gdax_fills }, session.requests
+
+def normalize(exchange, data):
+    entries = crypto_export.RecordStore()
+    if exchange == 'coinbase':
+        crypto_export.normalize_coinbase_accounts(data['coinbase_accounts'], entries, quiet)
+    else:
+        crypto_export.normalize_gdax_fills(data['gdax_fills'], entries)
+        crypto_export.normalize_gdax_accounts(data['gdax_accounts'], entries)
+    return entries
+
+def write(entries, filename, sort_buffer):
+    writer = crypto_export.ExportWriter(filename, sort_buffer)
+    for row in raw_rows(entries):
+        writer.append(*row)
+    writer.close()
+    return len(writer)
+
+def measure(stage, repeat):
+    # best time of 'repeat' runs, and the peak memory allocated during one more (traced) run
+    times = []
+    for i in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            stage()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stage()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+def measure_once(stage):
+    # time and peak memory of a single traced run, for stages which mostly wait (tracing doesn't slow that down)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        stage()
+        seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+def calibration():
+    # fixed mix of the work the stages do (amount parsing, sorting, JSON and string formatting)
+    rng = random.Random(0)
+    values = ['%0.8f' % rng.random() for i in range(20000)]
+    amounts = sorted(map(Decimal, values))
+    json.loads(json.dumps([format(amount, 'f') for amount in amounts]))
+
+def load_data(args, records):
+    if args.cache_prefix != None:
+        cache = crypto_export.JsonCache(args.cache_prefix)
+        return dict((name, cache.load(name)) for name in ['coinbase_accounts', 'gdax_accounts', 'gdax_fills'])
+    return {
+        'coinbase_accounts': fixtures.coinbase_accounts(records, args.seed),
+        'gdax_accounts': fixtures.gdax_accounts(records, args.seed),
+        'gdax_fills': fixtures.gdax_fills(records, args.seed) }
+
+def run_benchmarks(args, data, throttled_data, output_dir):
+    # (stage name, records, API requests, seconds, calibration seconds, peak bytes) for every stage of every
+    # exchange; throttled fetch stages use a calibration of 1 second
+    results = []
+    for exchange in ['coinbase', 'gdax']:
+        fetch = fetch_coinbase if exchange == 'coinbase' else fetch_gdax
+        fetched, requests = fetch(data, args.latency, args.workers)
+        if args.cache_prefix == None:
+            # the stubs must hand back exactly what they were given, or the other stages measure something else
+            expected = { 'coinbase_accounts': data['coinbase_accounts'] } if exchange == 'coinbase' else { 'gdax_accounts': data['gdax_accounts'], 'gdax_fills': data['gdax_fills'] }
+            if (fetched if exchange == 'gdax' else { 'coinbase_accounts': fetched }) != expected:
+                print("Stub %s fetch returned different data than the fixtures" % exchange)
+                sys.exit(1)
+        if exchange == 'gdax':
+            # pages are newest first, so the incremental sync mark must be the first entry of the first page
+            for account in fetched['gdax_accounts']:
+                if len(account['history'][0]) > 0 and crypto_export.gdax_sync_mark(account['history'], 'id') != account['history'][0][0]['id']:
+                    print("GDAX sync mark for %s is not the newest ledger entry" % account['id'])
+                    sys.exit(1)
+
+        entries = normalize(exchange, data)
+        filename = os.path.join(output_dir, '%s_transactions.csv' % exchange)
+        stages = [
+            ('fetch', lambda: fetch(data, args.latency, args.workers)),
+            ('normalize', lambda: normalize(exchange, data)),
+            ('sort', lambda: entries.sorted_indexes()),
+            ('write', lambda: write(entries, filename, args.sort_buffer))]
+        for name, stage in stages:
+            # calibrate right before each stage, so both see the same machine load
+            unit, unused = measure(calibration, args.repeat)
+            seconds, peak = measure(stage, args.repeat)
+            results.append(('%s %s' % (exchange, name), len(entries), requests if name == 'fetch' else 0, seconds, unit, peak))
+
+        # a fresh limiter with the exchange's default rate limit and burst for the run, like an export gets
+        limiter = crypto_export.get_rate_limiter(configparser.ConfigParser(), exchange)
+        throttled_requests = []
+        seconds, peak = measure_once(lambda: throttled_requests.append(fetch(throttled_data, args.latency, args.workers, limiter)[1]))
+        results.append(('%s throttled fetch' % exchange, len(normalize(exchange, throttled_data)), throttled_requests[0], seconds, 1.0, peak))
+    return results
+
+def compare(value, base):
+    return (value / base - 1) * 100 if base > 0 else 0
+
+def baseline_key(args):
+    if args.cache_prefix != None:
+        return 'cache=%s,latency=%g,workers=%d,sort_buffer=%d' % (args.cache_prefix, args.latency, args.workers, args.sort_buffer)
+    return 'records=%d,seed=%d,latency=%g,workers=%d,sort_buffer=%d' % (args.records, args.seed, args.latency, args.workers, args.sort_buffer)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--records", help="Number of synthetic records per cache file, default is 50000", type=int, default=50000)
+    parser.add_argument("-s", "--seed", help="Random seed for the synthetic data, default is 1", type=int, default=1)
+    parser.add_argument("-c", "--cache-prefix", help="Benchmark the JSON cache files with this file prefix instead of synthetic data")
+    parser.add_argument("-l", "--latency", help="Stub API latency per request in seconds, default is 0", type=float, default=0)
+    parser.add_argument("-w", "--workers", help="Number of concurrent API requests, default is 4", type=int, default=4)
+    parser.add_argument("-r", "--repeat", help="Number of timed runs per stage, default is 7", type=int, default=7)
+    parser.add_argument("--sort-buffer", help="Records sorted in memory by the writer, default is %d" % crypto_export.default_sort_buffer, type=int, default=crypto_export.default_sort_buffer)
+    parser.add_argument("-b", "--baseline", help="Baseline file, default is benchmarks/baseline.json", default=default_baseline)
+    parser.add_argument("-t", "--tolerance", help="Allowed memory growth over the baseline, default is 0.10 (10%%)", type=float, default=0.10)
+    parser.add_argument("--time-tolerance", help="Allowed slowdown over the baseline, relative to the calibration workload, default is 0.25 (25%%)", type=float, default=0.25)
+    parser.add_argument("--strict-time", help="Also fail when a stage is slower than the baseline allows for", action="store_true")
+    parser.add_argument("--save-baseline", help="Store the results as the baseline for these parameters", action="store_true")
+    args = parser.parse_args()
+
+    data = load_data(args, args.records)
+    throttled_data = data if args.cache_prefix != None or args.records <= throttled_records else load_data(args, throttled_records)
+    with tempfile.TemporaryDirectory() as output_dir:
+        results = run_benchmarks(args, data, throttled_data, output_dir)
+
+    baselines = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as infile:
+            baselines = json.load(infile)
+    key = baseline_key(args)
+    baseline = baselines.get(key, {})
+
+    print(key)
+    print("%-24s %10s %8s %10s %10s %10s  %s" % ('stage', 'records', 'requests', 'seconds', 'relative', 'peak MB', 'baseline'))
+    regressions = 0
+    slower = 0
+    for name, records, requests, seconds, unit, peak in results:
+        comparison = 'none'
+        if name in baseline:
+            # baselines stored before timings were calibrated only have a comparable peak memory
+            base_relative, base_peak = baseline[name].get('relative'), baseline[name]['peak_bytes']
+            comparison = '%+0.0f%% memory' % compare(peak, base_peak)
+            if base_relative != None:
+                comparison = '%+0.0f%% time, ' % compare(seconds / unit, base_relative) + comparison
+            if peak > base_peak * (1 + args.tolerance):
+                comparison = comparison + '  MEMORY REGRESSION'
+                regressions = regressions + 1
+            if base_relative != None and seconds / unit > base_relative * (1 + args.time_tolerance):
+                comparison = comparison + '  slower'
+                slower = slower + 1
+        print("%-24s %10d %8d %10.4f %10.1f %10.1f  %s" % (name, records, requests, seconds, seconds / unit, peak / 1e6, comparison))
+
+    if args.save_baseline:
+        baselines[key] = dict((name, { 'seconds': seconds, 'relative': seconds / unit, 'peak_bytes': peak }) for name, records, requests, seconds, unit, peak in results)
+        with open(args.baseline, 'w') as outfile:
+            json.dump(baselines, outfile, indent=2, sort_keys=True)
+        print("Stored baseline in %s" % args.baseline)
+        sys.exit(0)
+    if slower > 0:
+        print("%d stages slower than the baseline by more than %0.0f%%%s" % (slower, args.time_tolerance * 100, '' if args.strict_time else ' (timings are advisory, use --strict-time to fail on them)'))
+    if regressions > 0:
+        print("%d stages use more than %0.0f%% more memory than the baseline" % (regressions, args.tolerance * 100))
+    if regressions > 0 or (args.strict_time and slower > 0):
+        sys.exit(1)
@@ -0,0 +1,58 @@
+# Benchmark for GDAX fill normalization on synthetic fills
+#
+# Compares the column-wise normalize_gdax_fills() against the previous
+# row-by-row Decimal implementation, which is also the reference the output
+# must match exactly:
+#
+#   python benchmarks/bench_gdax_fills.py [-n FILLS] [-s SEED]
+
+import argparse, os, sys, time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import crypto_export
+import fixtures
+
+def reference_normalize_gdax_fills(gdax_fills, gdax_entries):
+    # previous behavior: parse and compute every fill's amounts one record at a time
+    for i, fill_page in enumerate(gdax_fills):
+        for j, fill in enumerate(fill_page):
+            row = [fill['created_at'], crypto_export.zero, 'XYZ', crypto_export.zero, 'XYZ', Decimal(fill['fee']), 'XYZ', '%s-%s' % (fill['order_id'], fill['trade_id']), 'USD volume: $%f' % float(fill['usd_volume']), 'trade', 'GDAX']
+            buy_cur, sell_cur = fill['product_id'].split('-')
+            row[6] = sell_cur
+            if fill['side'] == 'buy':
+                row[1] = Decimal(fill['size'])
+                row[2] = buy_cur
+                row[3] = ((Decimal(fill['size']) * Decimal(fill['price'])) + Decimal(fill['fee'])).quantize(crypto_export.places_8)
+                row[4] = sell_cur
+            else:
+                row[1] = ((Decimal(fill['size']) * Decimal(fill['price'])) - Decimal(fill['fee'])).quantize(crypto_export.places_8)
+                row[2] = sell_cur
+                row[3] = Decimal(fill['size'])
+                row[4] = buy_cur
+            gdax_entries.append(*row)
+
+def timed_normalize(gdax_fills, normalize):
+    entries = crypto_export.RecordStore()
+    start = time.perf_counter()
+    normalize(gdax_fills, entries)
+    return time.perf_counter() - start, entries
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--fills", help="Number of synthetic fills, default is 1000000", type=int, default=1000000)
+    parser.add_argument("-s", "--seed", help="Random seed, default is 1", type=int, default=1)
+    args = parser.parse_args()
+
+    gdax_fills = fixtures.gdax_fills(args.fills, args.seed)
+    reference_time, reference_entries = timed_normalize(gdax_fills, reference_normalize_gdax_fills)
+    columns_time, columns_entries = timed_normalize(gdax_fills, crypto_export.normalize_gdax_fills)
+
+    if len(columns_entries) != len(reference_entries) or any(columns_entries.row(i) != reference_entries.row(i) for i in range(len(reference_entries))):
+        print("Column-wise and reference normalization produced different rows")
+        sys.exit(1)
+
+    print("%d fills" % args.fills)
+    print("row by row:   %8.3f s" % reference_time)
+    print("column-wise:  %8.3f s" % columns_time)
+    print("speedup:      %8.1fx" % (reference_time / columns_time))
@@ -0,0 +1,242 @@
+# End-to-end check of the HTTP transport against a local fake API server
+#
+# Serves the synthetic Coinbase and GDAX data from fixtures.py over HTTP on
+# localhost, configures both exchanges with an 'api_url' pointing at it, and
+# runs the adapters' fetch() through the real Transport (requests session,
+# retries, response cache) with failures injected into chosen responses:
+#
+#   - HTTP 429/5xx responses are retried, honoring Retry-After
+#   - a request which keeps failing gives up after the configured retries
+#   - an interrupted download resumes from the response cache, requesting only
+#     the pages which weren't complete yet
+#   - a --local run leaves an interrupted download's response cache alone
+#
+# Needs the requests module, but not the coinbase or gdax connectors:
+#
+#   python benchmarks/check_transport.py [-n RECORDS]
+
+import argparse, os, sys, json, time, threading, tempfile, configparser, socketserver, http.server
+from urllib.parse import urlparse, parse_qsl
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import crypto_export
+import fixtures
+
+# retried requests wait at least this long instead of retry_backoff, to keep the check quick
+check_retry_backoff = 0.01
+
+def quiet(message):
+    pass
+
+class FakeApiServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    # serves the fixture stubs over HTTP: GDAX endpoints below /gdax, Coinbase endpoints below /v2. Injected
+    # failures are (path, params, responses) rules: a request for the path whose query includes all of params gets
+    # the next of the rule's (status, headers) responses until they are used up. Every request is logged as
+    # (time, path, params)
+    daemon_threads = True
+
+    def __init__(self, coinbase_client, gdax_session):
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', 0), FakeApiHandler)
+        self.coinbase_client = coinbase_client
+        self.gdax_session = gdax_session
+        self.lock = threading.Lock()
+        self.faults = []
+        self.log = []
+
+    def url(self, path=''):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1], path)
+
+    def inject(self, path, params, responses):
+        with self.lock:
+            self.faults.append((path, params, list(responses)))
+
+    def fault(self, path, params):
+        with self.lock:
+            self.log.append((time.monotonic(), path, params))
+            for fault_path, fault_params, responses in self.faults:
+                if fault_path == path and all(params.get(key) == value for key, value in fault_params.items()) and len(responses) > 0:
+                    return responses.pop(0)
+        return None
+
+    def requests(self, path, params={}):
+        # number of logged requests for a path whose query includes all of params
+        with self.lock:
+            return sum(1 for t, logged_path, logged_params in self.log if logged_path == path and all(logged_params.get(key) == value for key, value in params.items()))
+
+class FakeApiHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        fault = self.server.fault(url.path, params)
+        if fault != None:
+            status, headers = fault
+            self.respond(status, { 'message': 'injected failure' }, headers)
+            return
+
+        if url.path.startswith('/gdax/'):
+            response = self.server.gdax_session.get(fixtures.StubGdaxClient.url + url.path[len('/gdax'):], params)
+            self.respond(200, response.json(), response.headers)
+            return
+        parts = url.path.strip('/').split('/')
+        client = self.server.coinbase_client
+        if parts == ['v2', 'accounts']:
+            result = client.get_accounts()
+        else:
+            account_id, resource = parts[2], parts[3]
+            result = client.get_resource(resource, account_id, int(params.get('limit', 25)), params.get('order', 'desc'), params.get('starting_after'))
+        self.respond(200, { 'pagination': result.pagination, 'data': result['data'] })
+
+    def respond(self, status, document, headers={}):
+        body = json.dumps(document).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class HttpCoinbaseClient:
+    # minimal stand-in for coinbase.wallet.client.Client making real HTTP requests through its session, which the
+    # transport is installed on just like on the connector's own session
+    def __init__(self, api_url):
+        import requests
+        self.api_url = api_url.rstrip('/')
+        self.session = requests.Session()
+
+    def get(self, path, params):
+        r = self.session.get(self.api_url + path, params=params)
+        if r.status_code != 200:
+            raise Exception("Coinbase API error for %s: HTTP %d" % (path, r.status_code))
+        document = r.json()
+        return fixtures.StubResult({ 'data': document['data'] }, document['pagination'])
+
+    def get_accounts(self, **params):
+        return self.get('/v2/accounts', params)
+
+    def __getattr__(self, name):
+        # get_transactions(account_id, **params), get_buys(...), etc.
+        if not name.startswith('get_'):
+            raise AttributeError(name)
+        return lambda account_id, **params: self.get('/v2/accounts/%s/%s' % (account_id, name[len('get_'):]), params)
+
+class HttpGdaxClient:
+    # stand-in for gdax.AuthenticatedClient, which is only used for its URL and authentication
+    def __init__(self, api_url):
+        self.url = api_url
+        self.auth = None
+
+def fetch(config, prefix, exchange, local=False, workers=4):
+    # run an exchange adapter's fetch() like export_exchange() does, with clients for the fake server in place of
+    # the connector modules' clients
+    import requests
+    adapter = crypto_export.load_exchange_adapter(exchange)(config, crypto_export.JsonCache(prefix), prefix, local, False, workers, False)
+    adapter.log = quiet
+    if exchange == 'coinbase':
+        client = HttpCoinbaseClient(config['coinbase']['api_url'])
+        adapter.transport = adapter.create_transport(crypto_export.coinbase_page_complete)
+        adapter.transport.install(client.session, workers)
+    else:
+        client = HttpGdaxClient(config['gdax']['api_url'])
+        adapter.transport = adapter.create_transport(crypto_export.gdax_page_complete)
+        adapter.session = adapter.transport.install(requests.Session(), workers)
+    try:
+        return adapter.fetch(client)
+    finally:
+        adapter.close_checkpoint()
+
+def counted(name):
+    return sum(value for (counter_name, labels), value in crypto_export.metrics.counters.items() if counter_name == name)
+
+def check_exchange(server, config, prefix, exchange, expected, failing_page):
+    # returns a list of failed checks for one exchange; failing_page is a (path, params) request for a page in the
+    # middle of a multi-page download, after at least one complete page which can be cached
+    failures = []
+    check = lambda ok, message: failures.append(message) if not ok else None
+    retries = int(config[exchange]['retries'])
+    response_cache = os.path.join('%sresponse_cache' % prefix, exchange)
+    accounts_path = '/v2/accounts' if exchange == 'coinbase' else '/gdax/accounts'
+
+    # transient failures are retried, and the Retry-After header is honored
+    crypto_export.metrics.reset()
+    server.inject(accounts_path, {}, [(429, { 'Retry-After': '1' })])
+    server.inject(failing_page[0], failing_page[1], [(503, {}), (502, {})])
+    start = len(server.log)
+    data = fetch(config, prefix, exchange)
+    check(data == expected, "download with retried failures returned different data than the fixtures")
+    check(counted('retries') == 3, "%d retries counted instead of 3" % counted('retries'))
+    account_requests = [t for t, path, params in server.log[start:] if path == accounts_path]
+    check(len(account_requests) == 2 and account_requests[1] - account_requests[0] >= 1.0, "Retry-After of 1 second not honored")
+    check(not os.path.isdir(response_cache), "response cache not removed after a complete download")
+
+    # a request which keeps failing gives up after the configured number of retries
+    server.inject(failing_page[0], failing_page[1], [(500, {})] * (retries + 1))
+    before = server.requests(*failing_page)
+    try:
+        fetch(config, prefix, exchange)
+        check(False, "download succeeded although a page kept failing")
+    except Exception as e:
+        check('HTTP 500' in str(e), "unexpected error for a failing page: %s: %s" % (type(e).__name__, e))
+    check(server.requests(*failing_page) - before == retries + 1, "failing page requested fewer than %d times" % (retries + 1))
+    cached_pages = len(os.listdir(response_cache)) if os.path.isdir(response_cache) else 0
+    check(cached_pages > 0, "interrupted download left no completed pages in the response cache")
+
+    # a --local run only reads the cache files written by the first download and keeps the response cache
+    data = fetch(config, prefix, exchange, local=True)
+    check(data == expected, "--local run returned different data than the fixtures")
+    check(os.path.isdir(response_cache), "--local run removed the response cache of an interrupted download")
+
+    # the next download resumes from the completed pages, and only requests the rest
+    crypto_export.metrics.reset()
+    before = server.requests(*failing_page)
+    data = fetch(config, prefix, exchange)
+    check(data == expected, "resumed download returned different data than the fixtures")
+    check(counted('response_cache_hits') == cached_pages, "resumed download read %d of %d completed pages from the response cache" % (counted('response_cache_hits'), cached_pages))
+    check(server.requests(*failing_page) - before == 1, "page which failed before not requested exactly once")
+    check(not os.path.isdir(response_cache), "response cache not removed after the resumed download")
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--records", help="Number of synthetic records per cache file, default is 3000", type=int, default=3000)
+    parser.add_argument("-s", "--seed", help="Random seed for the synthetic data, default is 1", type=int, default=1)
+    args = parser.parse_args()
+
+    crypto_export.retry_backoff = check_retry_backoff
+    coinbase_accounts = fixtures.coinbase_accounts(args.records, args.seed)
+    gdax_accounts = fixtures.gdax_accounts(args.records, args.seed)
+    gdax_fills = fixtures.gdax_fills(args.records, args.seed)
+    server = FakeApiServer(fixtures.StubCoinbaseClient(coinbase_accounts), fixtures.StubGdaxSession(gdax_accounts, gdax_fills))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # a page in the middle of each download: the third page (of 100 records) of the first account's transactions,
+    # and the third page of the first GDAX account's ledger
+    coinbase_account = coinbase_accounts['data'][0]
+    gdax_account = gdax_accounts[0]
+    failing_pages = {
+        'coinbase': ('/v2/accounts/%s/transactions' % coinbase_account['id'], { 'starting_after': coinbase_account['transactions']['data'][199]['id'] }),
+        'gdax': ('/gdax/accounts/%s/ledger' % gdax_account['id'], { 'after': gdax_account['history'][1][-1]['id'] }) }
+    expected = {
+        'coinbase': { 'coinbase_accounts': coinbase_accounts },
+        'gdax': { 'gdax_accounts': gdax_accounts, 'gdax_fills': gdax_fills } }
+
+    failed = 0
+    with tempfile.TemporaryDirectory() as output_dir:
+        prefix = os.path.join(output_dir, '')
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'files': { 'prefix': prefix },
+            'coinbase': { 'key': 'key', 'secret': 'secret', 'api_url': server.url('/'), 'rate_limit': '0', 'retries': '3' },
+            'gdax': { 'key': 'key', 'secret': 'secret', 'passphrase': 'passphrase', 'api_url': server.url('/gdax'), 'rate_limit': '0', 'retries': '3' } })
+        for exchange in ['coinbase', 'gdax']:
+            failures = check_exchange(server, config, prefix, exchange, expected[exchange], failing_pages[exchange])
+            print("%-10s %s" % (exchange, 'ok' if len(failures) == 0 else 'FAILED'))
+            for failure in failures:
+                print("- %s" % failure)
+            failed = failed + len(failures)
+    server.shutdown()
+    if failed > 0:
+        sys.exit(1)
@@ -0,0 +1,407 @@
+# Synthetic exchange data and API stubs for the benchmarks
+#
+# Generates cache files in the same layout as the ones written by the export
+# script (coinbase_accounts.json, gdax_accounts.json and gdax_fills.json), and
+# provides stub API clients which serve them with the exchanges' pagination
+# behavior and an optional per-request latency. The generated files can also
+# be used for --local runs of the script:
+#
+#   python benchmarks/fixtures.py [-n RECORDS] [-s SEED] [-p PREFIX]
+#
+# Records are generated one at a time and written to the cache files as they
+# are created, so files of 10M records or more only take as much memory as a
+# single account's buy IDs. The coinbase_accounts(), gdax_accounts() and
+# gdax_fills() functions used by the benchmarks build the same data in memory
+# instead, which takes about 1 KB per record: 1M records in each of the three
+# caches needs about 3 GB.
+
+import argparse, os, sys, json, time, uuid, random, bisect, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import crypto_export
+
+# synthetic records are spread between these dates (2015-01-01 to 2018-02-15 UTC)
+first_timestamp = 1420070400
+last_timestamp = 1518652800
+
+coinbase_currencies = ['BTC', 'ETH', 'LTC', 'BCH']
+gdax_currencies = ['USD', 'BTC', 'ETH', 'LTC', 'BCH']
+gdax_products = ['BTC-USD', 'ETH-USD', 'LTC-USD', 'BCH-USD', 'ETH-BTC', 'LTC-BTC', 'BCH-BTC']
+
+# approximate USD prices, only used to make amounts look plausible
+usd_prices = { 'BTC': 5000.0, 'ETH': 400.0, 'LTC': 80.0, 'BCH': 1200.0, 'USD': 1.0 }
+
+def split(total, parts):
+    # split a record count into nearly equal parts
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+def guid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128)))
+
+def timestamps(rng, count, descending=False):
+    # 'count' increasing (or decreasing) random timestamps covering the whole date range, one per equal slot
+    # (seconds since the epoch, with a millisecond fraction)
+    slot = (last_timestamp - first_timestamp) / max(1, count)
+    for i in (range(count - 1, -1, -1) if descending else range(count)):
+        yield round(first_timestamp + (i + rng.random()) * slot, 3)
+
+def coinbase_time(t):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
+
+def gdax_time(t):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(t)) + '.%03dZ' % (int(round(t * 1000)) % 1000)
+
+def coinbase_money(amount, currency):
+    return { 'amount': ('%0.8f' if currency != 'USD' else '%0.2f') % amount, 'currency': currency }
+
+def coinbase_trades(rng, count, currency, kind, buy_ids):
+    # synthetic Coinbase buys or sells, with IDs from buy_ids for buys so that transactions can refer to them
+    for i, t in enumerate(timestamps(rng, count)):
+        amount = rng.uniform(0.001, 2.0)
+        subtotal = amount * usd_prices[currency]
+        fee = max(0.99, subtotal * 0.0149)
+        yield {
+            'id': buy_ids[i] if kind == 'buy' else guid(rng),
+            'status': rng.choice(['completed'] * 19 + ['canceled']),
+            'created_at': coinbase_time(t),
+            'amount': coinbase_money(amount, currency),
+            'subtotal': coinbase_money(subtotal, 'USD'),
+            'total': coinbase_money(subtotal + fee if kind == 'buy' else subtotal - fee, 'USD'),
+            'user_reference': ''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ23456789') for i in range(8)) }
+
+def coinbase_transactions(rng, count, account_id, currency, buy_ids):
+    # synthetic Coinbase transactions covering every type handled by normalize_coinbase_accounts()
+    for t in timestamps(rng, count):
+        amount = rng.uniform(0.001, 2.0)
+        transaction = {
+            'id': guid(rng),
+            'status': rng.choice(['completed'] * 19 + ['canceled']),
+            'created_at': coinbase_time(t),
+            'amount': coinbase_money(amount, currency),
+            'native_amount': coinbase_money(amount * usd_prices[currency], 'USD'),
+            'network': { 'status': 'confirmed' } }
+        kind = rng.choice(['buy', 'buy', 'sell', 'send_in', 'send_out', 'off_blockchain', 'exchange_deposit', 'exchange_withdrawal'])
+        if kind in ['buy', 'sell']:
+            transaction['type'] = kind
+            transaction['details'] = { 'title': 'Bought %s' % currency if kind == 'buy' else 'Sold %s' % currency, 'subtitle': 'using Bank', 'payment_method_name': 'Bank *1234' }
+        elif kind == 'send_in':
+            transaction['type'] = 'send'
+            transaction['from'] = { 'resource': 'user' }
+        elif kind == 'send_out':
+            transaction['type'] = 'send'
+            transaction['amount'] = coinbase_money(-amount, currency)
+            transaction['native_amount'] = coinbase_money(-amount * usd_prices[currency], 'USD')
+            transaction['to'] = { 'resource': rng.choice(['bitcoin_address', 'email']) }
+        elif kind == 'off_blockchain':
+            transaction['type'] = 'send'
+            transaction['from'] = { 'resource': 'user' }
+            transaction['network'] = { 'status': 'off_blockchain' }
+            if len(buy_ids) > 0:
+                transaction['buy'] = { 'resource_path': '/v2/accounts/%s/buys/%s' % (account_id, rng.choice(buy_ids)) }
+        else:
+            transaction['type'] = kind
+            transaction['details'] = { 'title': 'Transferred %s' % currency, 'subtitle': 'to GDAX' if kind == 'exchange_withdrawal' else 'from GDAX' }
+            if kind == 'exchange_withdrawal':
+                transaction['amount'] = coinbase_money(-amount, currency)
+                transaction['native_amount'] = coinbase_money(-amount * usd_prices[currency], 'USD')
+        yield transaction
+
+def coinbase_account_stream(records, seed=1):
+    # synthetic Coinbase accounts as (account details, resource -> record iterator) with about 'records' buys,
+    # sells and transactions spread over one account per crypto currency, plus a USD wallet which the export
+    # skips; each resource has its own random generator, so records can be created in any order
+    rng = random.Random(seed)
+    for currency, count in zip(coinbase_currencies + ['USD'], split(records, len(coinbase_currencies)) + [0]):
+        balance = rng.uniform(0, 10) if currency != 'USD' else 0
+        account = {
+            'id': guid(rng),
+            'name': '%s Wallet' % currency,
+            'type': 'wallet' if currency != 'USD' else 'fiat',
+            'currency': currency,
+            'balance': coinbase_money(balance, currency),
+            'native_balance': coinbase_money(balance * usd_prices[currency], 'USD') }
+        buy_count = count // 5
+        sell_count = count // 10
+        buy_ids = [guid(rng) for i in range(buy_count)]
+        resource_rngs = [random.Random(rng.getrandbits(64)) for i in range(3)]
+        yield account, {
+            'transactions': coinbase_transactions(resource_rngs[0], count - buy_count - sell_count, account['id'], currency, buy_ids),
+            'buys': coinbase_trades(resource_rngs[1], buy_count, currency, 'buy', buy_ids),
+            'sells': coinbase_trades(resource_rngs[2], sell_count, currency, 'sell', buy_ids),
+            'deposits': iter([]),
+            'withdrawals': iter([]) }
+
+def gdax_pages(entries, page_size=crypto_export.gdax_page_size):
+    # newest first entries -> pages as collected by paginate_gdax(); an endpoint without entries still has its
+    # (empty) first page
+    page = []
+    pages = 0
+    for entry in entries:
+        page.append(entry)
+        if len(page) == page_size:
+            yield page
+            pages = pages + 1
+            page = []
+    if len(page) > 0 or pages == 0:
+        yield page
+
+def gdax_ledger(rng, count, first_id, currency, balance):
+    # synthetic GDAX ledger entries (matches, fees and transfers), newest first; IDs are strings like the API's
+    for i, t in zip(range(count - 1, -1, -1), timestamps(rng, count, descending=True)):
+        kind = rng.choice(['match', 'match', 'match', 'fee', 'transfer'])
+        amount = rng.uniform(0.001, 2.0) * usd_prices['BTC'] / usd_prices[currency] / 10
+        entry = { 'id': str(first_id + i), 'created_at': gdax_time(t), 'amount': '%0.16f' % amount, 'balance': '%0.16f' % balance, 'type': kind }
+        if kind == 'match':
+            entry['details'] = { 'order_id': guid(rng), 'trade_id': str(rng.randint(1, 10 ** 8)), 'product_id': rng.choice(gdax_products) }
+        elif kind == 'fee':
+            entry['amount'] = '%0.16f' % -amount
+            entry['details'] = { 'order_id': guid(rng), 'trade_id': str(rng.randint(1, 10 ** 8)), 'product_id': rng.choice(gdax_products) }
+        else:
+            transfer_type = rng.choice(['deposit', 'withdraw'])
+            if transfer_type == 'withdraw':
+                entry['amount'] = '%0.16f' % -amount
+            entry['details'] = { 'transfer_id': guid(rng), 'transfer_type': transfer_type }
+        yield entry
+
+def gdax_account_stream(records, seed=1):
+    # synthetic GDAX accounts as (account details, history page iterator) with about 'records' ledger entries
+    # spread over one account per currency
+    rng = random.Random(seed)
+    profile_id = guid(rng)
+    first_id = 1
+    for currency, count in zip(gdax_currencies, split(records, len(gdax_currencies))):
+        balance = rng.uniform(0, 10) * (1000 if currency == 'USD' else 1)
+        hold = balance * rng.choice([0, 0, 0.1])
+        account = {
+            'id': guid(rng),
+            'currency': currency,
+            'balance': '%0.16f' % balance,
+            'available': '%0.16f' % (balance - hold),
+            'hold': '%0.16f' % hold,
+            'profile_id': profile_id }
+        yield account, gdax_pages(gdax_ledger(random.Random(rng.getrandbits(64)), count, first_id, currency, balance))
+        first_id = first_id + count
+
+def gdax_product_fills(rng, count, product_id):
+    # synthetic GDAX fills for one product, newest first
+    base_currency, quote_currency = product_id.split('-')
+    for trade_id, t in zip(range(count, 0, -1), timestamps(rng, count, descending=True)):
+        price = usd_prices[base_currency] / usd_prices[quote_currency] * rng.uniform(0.5, 1.5)
+        size = rng.uniform(0.001, 2.0)
+        liquidity = rng.choice(['M', 'T'])
+        fee = price * size * 0.0025 if liquidity == 'T' else 0
+        yield {
+            'created_at': gdax_time(t),
+            'trade_id': trade_id,
+            'product_id': product_id,
+            'order_id': guid(rng),
+            'user_id': '5a1b2c3d4e5f60718293a4b5',
+            'profile_id': '00000000-0000-0000-0000-000000000000',
+            'liquidity': liquidity,
+            'price': '%0.8f' % price,
+            'size': '%0.8f' % size,
+            'fee': '%0.16f' % fee,
+            'side': rng.choice(['buy', 'sell']),
+            'settled': True,
+            'usd_volume': '%0.16f' % (size * usd_prices[base_currency]) }
+
+def gdax_fill_pages(records, seed=1):
+    # synthetic GDAX fill pages with 'records' fills spread over all products, in product order
+    rng = random.Random(seed)
+    for product_id, count in zip(gdax_products, split(records, len(gdax_products))):
+        yield from gdax_pages(gdax_product_fills(random.Random(rng.getrandbits(64)), count, product_id))
+
+def coinbase_accounts(records, seed=1):
+    # synthetic Coinbase cache document (coinbase_accounts.json), in memory
+    data = []
+    for account, resources in coinbase_account_stream(records, seed):
+        for resource in crypto_export.coinbase_resources:
+            account[resource] = { 'data': list(resources[resource]) }
+        data.append(account)
+    return { 'data': data }
+
+def gdax_accounts(records, seed=1):
+    # synthetic GDAX cache document (gdax_accounts.json), in memory
+    accounts = []
+    for account, pages in gdax_account_stream(records, seed):
+        account['history'] = list(pages)
+        accounts.append(account)
+    return accounts
+
+def gdax_fills(records, seed=1):
+    # synthetic GDAX cache document (gdax_fills.json), in memory
+    return list(gdax_fill_pages(records, seed))
+
+def write_list(outfile, items):
+    # write a JSON list one item at a time
+    outfile.write('[')
+    for i, item in enumerate(items):
+        outfile.write(', ' if i > 0 else '')
+        json.dump(item, outfile)
+    outfile.write(']')
+
+def write_coinbase_accounts(outfile, records, seed=1):
+    # stream a synthetic Coinbase cache document to a file
+    outfile.write('{"data": [')
+    for i, (account, resources) in enumerate(coinbase_account_stream(records, seed)):
+        outfile.write(', ' if i > 0 else '')
+        outfile.write(json.dumps(account)[:-1])
+        for resource in crypto_export.coinbase_resources:
+            outfile.write(', "%s": {"data": ' % resource)
+            write_list(outfile, resources[resource])
+            outfile.write('}')
+        outfile.write('}')
+    outfile.write(']}')
+
+def write_gdax_accounts(outfile, records, seed=1):
+    # stream a synthetic GDAX accounts cache document to a file
+    outfile.write('[')
+    for i, (account, pages) in enumerate(gdax_account_stream(records, seed)):
+        outfile.write(', ' if i > 0 else '')
+        outfile.write(json.dumps(account)[:-1] + ', "history": ')
+        write_list(outfile, pages)
+        outfile.write('}')
+    outfile.write(']')
+
+def write_gdax_fills(outfile, records, seed=1):
+    # stream a synthetic GDAX fills cache document to a file
+    write_list(outfile, gdax_fill_pages(records, seed))
+
+class StubResult(dict):
+    # Coinbase API response: the decoded JSON document, with the pagination details as an attribute
+    def __init__(self, data, pagination=None):
+        dict.__init__(self, data)
+        self.pagination = pagination
+
+class StubCoinbaseClient:
+    # stand-in for coinbase.wallet.client.Client serving a Coinbase cache document: list endpoints return pages
+    # of up to 'limit' records after the 'starting_after' record with a next_uri while more remain, like the API;
+    # every request waits for 'limiter' (a crypto_export.RateLimiter, if given), takes 'latency' seconds and is
+    # counted in 'requests'
+    def __init__(self, coinbase_accounts, latency=0, limiter=None):
+        self.latency = latency
+        self.limiter = limiter
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.accounts = [{ k: v for k, v in account.items() if k not in crypto_export.coinbase_resources } for account in coinbase_accounts['data']]
+        self.resources = {}
+        for account in coinbase_accounts['data']:
+            for resource in crypto_export.coinbase_resources:
+                records = list(account.get(resource, { 'data': [] })['data'])
+                self.resources[(account['id'], resource)] = (records, { record['id']: i for i, record in enumerate(records) })
+
+    def request(self):
+        if self.limiter != None:
+            self.limiter.wait()
+        with self.lock:
+            self.requests = self.requests + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get_accounts(self, **params):
+        self.request()
+        return StubResult({ 'data': [dict(account) for account in self.accounts] })
+
+    def get_resource(self, resource, account_id, limit=25, order='desc', starting_after=None, **params):
+        self.request()
+        records, positions = self.resources[(account_id, resource)]
+        start = positions[starting_after] + 1 if starting_after != None else 0
+        page = records[start:start + limit]
+        next_uri = None
+        if start + limit < len(records):
+            next_uri = '/v2/accounts/%s/%s?limit=%d&order=%s&starting_after=%s' % (account_id, resource, limit, order, page[-1]['id'])
+        return StubResult({ 'data': page }, { 'limit': limit, 'order': order, 'starting_after': starting_after, 'next_uri': next_uri })
+
+    def get_transactions(self, account_id, **params):
+        return self.get_resource('transactions', account_id, **params)
+
+    def get_buys(self, account_id, **params):
+        return self.get_resource('buys', account_id, **params)
+
+    def get_sells(self, account_id, **params):
+        return self.get_resource('sells', account_id, **params)
+
+    def get_deposits(self, account_id, **params):
+        return self.get_resource('deposits', account_id, **params)
+
+    def get_withdrawals(self, account_id, **params):
+        return self.get_resource('withdrawals', account_id, **params)
+
+class StubResponse:
+    # requests.Response stand-in returned by StubGdaxSession
+    def __init__(self, payload, headers={}):
+        self.status_code = 200
+        self.payload = payload
+        self.headers = headers
+
+    def json(self):
+        return self.payload
+
+    @property
+    def text(self):
+        return json.dumps(self.payload)
+
+class StubGdaxClient:
+    # stand-in for gdax.AuthenticatedClient, which is only used for its URL and authentication
+    url = 'https://api.gdax.invalid'
+    auth = None
+
+class StubGdaxSession:
+    # stand-in for the requests session used by gdax_get(), serving GDAX cache documents: ledger and fills
+    # endpoints return up to 'limit' entries older than an 'after' cursor or newer than a 'before' cursor, newest
+    # first, with cb-after/cb-before headers like the API; every request waits for 'limiter' (a
+    # crypto_export.RateLimiter, if given), takes 'latency' seconds and is counted in 'requests'
+    def __init__(self, gdax_accounts, gdax_fills, products=gdax_products, latency=0, limiter=None):
+        self.latency = latency
+        self.limiter = limiter
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.products = [{ 'id': product_id } for product_id in products]
+        self.accounts = [{ k: v for k, v in account.items() if k != 'history' } for account in gdax_accounts]
+        self.endpoints = {}
+        for account in gdax_accounts:
+            self.add_endpoint('/accounts/%s/ledger' % account['id'], None, account['history'], lambda entry: int(entry['id']))
+        for product in self.products:
+            self.add_endpoint('/fills', product['id'], [[fill for fill in page if fill['product_id'] == product['id']] for page in gdax_fills], lambda fill: fill['trade_id'])
+
+    def add_endpoint(self, path, product_id, pages, key):
+        entries = sorted((entry for page in pages for entry in page), key=key)
+        self.endpoints[(path, product_id)] = (entries, [key(entry) for entry in entries])
+
+    def get(self, url, params=None, auth=None):
+        if self.limiter != None:
+            self.limiter.wait()
+        with self.lock:
+            self.requests = self.requests + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        params = params or {}
+        path = url[len(StubGdaxClient.url):]
+        if path == '/products':
+            return StubResponse(self.products)
+        if path == '/accounts':
+            return StubResponse([dict(account) for account in self.accounts])
+
+        entries, keys = self.endpoints[(path, params.get('product_id'))]
+        limit = int(params.get('limit', crypto_export.gdax_page_size))
+        if 'before' in params:
+            start = bisect.bisect_right(keys, int(params['before']))
+            page = entries[start:start + limit][::-1]
+            return StubResponse(page, { 'cb-before': str(keys[start + len(page) - 1]) } if len(page) > 0 else {})
+        end = bisect.bisect_left(keys, int(params['after'])) if 'after' in params else len(entries)
+        start = max(0, end - limit)
+        page = entries[start:end][::-1]
+        return StubResponse(page, { 'cb-after': str(keys[start]) } if start > 0 else {})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--records", help="Number of synthetic records in each cache file, default is 10000", type=int, default=10000)
+    parser.add_argument("-s", "--seed", help="Random seed, default is 1", type=int, default=1)
+    parser.add_argument("-p", "--prefix", help="File name prefix for the generated cache files, default is none", default='')
+    args = parser.parse_args()
+
+    cache = crypto_export.JsonCache(args.prefix)
+    for name, write in [('coinbase_accounts', write_coinbase_accounts), ('gdax_accounts', write_gdax_accounts), ('gdax_fills', write_gdax_fills)]:
+        print("Writing %d synthetic records to %s" % (args.records, cache.filename(name)))
+        with crypto_export.atomic_write(cache.filename(name)) as outfile:
+            write(outfile, args.records, args.seed)
@@ -32,155 +32,1055 @@
 #
 # Fix for winrandom problem with WinPython 3.5 64bit: https://stackoverflow.com/a/39478958/2863900
 
-import argparse, configparser, os, sys, re, json
+import argparse, configparser, os, sys, re, json, threading, time, calendar, mmap, csv, heapq, tempfile, asyncio, traceback
+import hashlib, random, shutil, contextlib, multiprocessing, cProfile, pstats, tracemalloc
 import pprint
+from array import array
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlparse
+from decimal import Decimal, Context, localcontext, ROUND_HALF_EVEN
 
-supported_exchanges = ['coinbase', 'gdax']
-
-# welcome banner with script version
-print("-------------------------------")
-print("Crypto Export Script 20180215.0")
-print("-------------------------------")
-print("")
-
-# define and parse command line arguments
-parser = argparse.ArgumentParser()
-parser.add_argument("-c", "--config", help="Configuration file, default is crypto_export.conf", default="crypto_export.conf")
-parser.add_argument("-i", "--include", help="List of exchanges to include (whitelist) for this job", nargs="+")
-parser.add_argument("-x", "--exclude", help="List of exchanges to exclude (blacklist) for this job", nargs="+")
-parser.add_argument("-l", "--local", help="Use locally stored cache files if present", action="store_true")
-args = parser.parse_args()
-
-# make sure configuration file exists
-if not os.path.isfile(args.config):
-    print("Cannot find config file '%s'" % args.config)
-    sys.exit(1)
-
-# read configuration details
-config = configparser.ConfigParser()
-config.read(args.config)
-
-# get file prefix settings, if configured
-file_prefix = ''
-if 'files' in config.sections():
-    if 'prefix' in config['files']:
-        file_prefix = config['files']['prefix']
-
-# find all defined exchanges that we care about
-print("Supported exchanges: %s" % supported_exchanges)
-print("Whitelisted exchanges: %s" % args.include)
-print("Blacklisted exchanges: %s" % args.exclude)
-defined_exchanges = []
-queued_exchanges = []
-for exchange in supported_exchanges:
-    # skip if we have a whitelist and this isn't on it
-    if args.include != None and exchange not in args.include:
-        print("Skipping checks for '%s'" % exchange)
-        continue
-
-    print("Checking for '%s' definition in configuration file..." % exchange, end='')
+# Coinbase resource types fetched for every account, in the order they are stored in the cache
+coinbase_resources = ['transactions', 'buys', 'sells', 'deposits', 'withdrawals']
+
+# CSV output columns (each row also has a trailing exchange name column)
+export_header = ['Trade date', 'Buy amount', 'Buy currency', 'Sell amount', 'Sell currency', 'Fee amount', 'Fee currency', 'Trade ID', 'Comment', 'Type']
+
+# export records sorted in memory before spilling sorted runs to disk, overridable with 'sort_buffer' in [files]
+default_sort_buffer = 1000000
+
+# number of records converted at once by column-wise normalization
+normalize_chunk_size = 1000
+
+# file buffer size for CSV output and sort runs
+write_buffer_size = 1 << 20
+
+# published API request limits (requests per second), overridable with 'rate_limit' in each exchange section
+# - Coinbase: 10,000 requests per hour per API key
+# - GDAX: 5 requests per second for private endpoints
+default_rate_limits = { 'coinbase': 10000 / 3600.0, 'gdax': 5.0 }
+
+# number of requests which may be sent back to back before the rate limit applies, overridable with 'rate_burst'
+# - Coinbase: the limit is an hourly quota, so the whole hour's 10,000 requests may be used at once
+# - GDAX: bursts of up to 10 requests per second
+# exchanges added through plugins default to 1 request per second without bursts
+default_rate_bursts = { 'coinbase': 10000, 'gdax': 10 }
+
+# API hosts used when no 'api_url' is configured, for sharing rate limits between the profiles of a batch run
+default_api_urls = { 'coinbase': 'https://api.coinbase.com/', 'gdax': 'https://api.gdax.com' }
+
+# rate limit state shared by all worker processes of a batch run, keyed by rate_budget_key(); set in each worker
+# process by run_batch_profile()
+batch_rate_budgets = {}
+
+# transient API failures (connection errors, timeouts, HTTP 429 and 5xx responses) are retried with exponential
+# backoff and full jitter: attempt n waits a random time up to min(retry_backoff * 2^n, retry_backoff_max) seconds,
+# or at least as long as the server's Retry-After header asks for; the number of retries is overridable with
+# 'retries' in each exchange section
+default_retries = 5
+retry_backoff = 0.5
+retry_backoff_max = 30.0
+retry_statuses = (429, 500, 502, 503, 504)
+
+# timeout in seconds for each API request
+request_timeout = 30
+
+# GDAX page size for cursor requests
+gdax_page_size = 100
+
+# completed API pages are kept in <prefix>response_cache/ until the exchange's cache file has been stored, so an
+# interrupted run can resume from the last completed page; entries older than this many seconds are ignored,
+# overridable with 'response_cache_ttl' in [files] (0 disables the response cache)
+default_response_cache_ttl = 86400
+
+# extracts the cursor GUID from a Coinbase pagination next_uri
+starting_after_pattern = re.compile('starting_after=([0-9a-f]{8}-([0-9a-f]{4}-){3}[0-9a-f]{12})', re.I)
+
+# ISO 8601 timestamps as returned by the exchange APIs, e.g. 2018-02-15T12:34:56Z or 2018-02-15T12:34:56.123456Z
+timestamp_pattern = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?(Z|[+-]\d\d:?\d\d)?$')
+
+# exact amount constants. Computed amounts (fees, totals and negated withdrawals) are exact Decimals rounded to 8
+# places (16 for GDAX transfers) with round-half-even. Versions before the RecordStore rounded binary floats with
+# '%0.8f' instead, so re-exported amounts can differ from older exports in the last decimal place. The arithmetic
+# and rounding use amount_context, whose precision leaves room for 16 decimal places on amounts far larger than
+# the default 28 digit context allows (e.g. 2500000000000.0000000000000000 of a token)
+zero = Decimal(0)
+places_8 = Decimal('1e-8')
+places_16 = Decimal('1e-16')
+amount_context = Context(prec=60, rounding=ROUND_HALF_EVEN)
+
+# metrics output formats for --metrics-format
+metrics_formats = ['jsonl', 'prometheus']
+
+class Metrics:
+    # thread-safe run instrumentation: timers (total seconds and number of timed runs) and counters, each keyed
+    # by name and a set of labels such as exchange, account or endpoint. A single instance (metrics) collects
+    # everything for the current process; records() returns it as plain dicts for write_metrics()
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+
+    def add_time(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            total, count = self.timers.get(key, (0.0, 0))
+            self.timers[key] = (total + seconds, count + 1)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, **labels)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def records(self, process_labels={}, **labels):
+        # every timer and counter with extra labels added, plus the peak resident memory of this process. The peak
+        # covers the whole life of the process, so in a batch run it is labeled with process_labels (the worker)
+        # rather than the profile, since a worker process exports several profiles one after another
+        records = []
+        with self.lock:
+            for (name, timer_labels), (total, count) in self.timers.items():
+                records.append({ 'type': 'timer', 'name': name, 'labels': dict(timer_labels, **labels), 'seconds': total, 'count': count })
+            for (name, counter_labels), value in self.counters.items():
+                records.append({ 'type': 'counter', 'name': name, 'labels': dict(counter_labels, **labels), 'value': value })
+        rss = peak_rss()
+        if rss != None:
+            records.append({ 'type': 'gauge', 'name': 'peak_rss_bytes', 'labels': process_labels, 'value': rss })
+        return records
+
+# instrumentation for the current process (reset for every profile of a batch run)
+metrics = Metrics()
+
+def peak_rss():
+    # peak resident set size of this process in bytes, or None where the resource module isn't available (Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+def prometheus_labels(labels):
+    if len(labels) == 0:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (key, escape(value)) for key, value in sorted(labels.items()))
+
+def write_metrics(filename, records, format='jsonl'):
+    # write metrics records (see Metrics.records()) as JSON lines, or in the Prometheus text exposition format
+    # with timers as summaries (crypto_export_<name>_seconds) and counters as crypto_export_<name>_total
+    with atomic_write(filename) as outfile:
+        if format == 'jsonl':
+            for record in records:
+                outfile.write(json.dumps(record, sort_keys=True) + '\n')
+            return
+        families = {}
+        for record in records:
+            families.setdefault((record['type'], record['name']), []).append(record)
+        for (type, name), family in families.items():
+            if type == 'timer':
+                outfile.write('# TYPE crypto_export_%s_seconds summary\n' % name)
+                for record in family:
+                    outfile.write('crypto_export_%s_seconds_sum%s %r\n' % (name, prometheus_labels(record['labels']), record['seconds']))
+                    outfile.write('crypto_export_%s_seconds_count%s %d\n' % (name, prometheus_labels(record['labels']), record['count']))
+            elif type == 'counter':
+                outfile.write('# TYPE crypto_export_%s_total counter\n' % name)
+                for record in family:
+                    outfile.write('crypto_export_%s_total%s %d\n' % (name, prometheus_labels(record['labels']), record['value']))
+            else:
+                outfile.write('# TYPE crypto_export_%s gauge\n' % name)
+                for record in family:
+                    outfile.write('crypto_export_%s%s %d\n' % (name, prometheus_labels(record['labels']), record['value']))
+
+class RateLimiter:
+    # thread-safe token bucket shared by all worker threads of an exchange: up to 'burst' requests can be sent
+    # back to back, after that requests are spaced out to the exchange's request rate (0 means unlimited). Since
+    # every request goes through it, it is also where a cancelled export stops. In a batch run, the bucket state
+    # (token count and last update time) and its lock are held by a multiprocessing manager, so every profile using
+    # the same API key draws from one budget across all worker processes
+    def __init__(self, rate, burst=1, cancel_event=None, state=None, lock=None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        if state == None:
+            self.state = [self.burst, time.monotonic()]
+            self.lock = threading.Lock()
+        else:
+            self.state = state
+            self.lock = lock
+        self.cancel_event = cancel_event
+
+    def check_cancelled(self):
+        if self.cancel_event != None and self.cancel_event.is_set():
+            raise ExportCancelled("Export cancelled")
+
+    def sleep(self, delay):
+        # sleep which is cut short by cancelling the export
+        if self.cancel_event != None:
+            self.cancel_event.wait(delay)
+        else:
+            time.sleep(delay)
+        self.check_cancelled()
+
+    def wait(self):
+        self.check_cancelled()
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self.state[0] + (now - self.state[1]) * self.rate)
+            # a negative balance reserves a slot for this request behind the ones already waiting
+            tokens = tokens - 1
+            self.state[0] = tokens
+            self.state[1] = now
+        if tokens < 0:
+            self.sleep(-tokens / self.rate)
+
+def get_rate_limit(config, exchange):
+    # (requests per second, burst size) for an exchange
+    rate = default_rate_limits.get(exchange, 1.0)
+    burst = default_rate_bursts.get(exchange, 1)
     if exchange in config.sections():
-        print("found")
-        defined_exchanges.append(exchange)
-    else:
-        print("not found")
-        if args.include != None and exchange in args.include:
-            print("Explicitly included exchange '%s' is not defined in config file" % exchange)
-            sys.exit(2)
-        continue
-
-    if (args.exclude == None or exchange not in args.exclude) and (args.include == None or exchange in args.include):
-        queued_exchanges.append(exchange)
-
-# import modules required to run job
-print("Job list: %s" % ', '.join(queued_exchanges))
-
-# COINBASE EXPORT
-if 'coinbase' in queued_exchanges:
-    from coinbase.wallet.client import Client as CoinbaseClient
-    if not set(['key', 'secret']).issubset(set(config['coinbase'])):
-        print("Coinbase configuration requires 'key' and 'secret' values")
-        sys.exit(3)
-
-    print("Creating Coinbase client")
-    coinbase_client = CoinbaseClient(config['coinbase']['key'], config['coinbase']['secret'])
-
-    if args.local and os.path.isfile('%scoinbase_accounts.json' % file_prefix):
-        print("Reading Coinbase account details from %scoinbase_accounts.json" % file_prefix)
-        with open('%scoinbase_accounts.json' % file_prefix, 'r') as infile:
-            coinbase_accounts = json.load(infile)
-    else:
-        print("Getting Coinbase account list via API")
-        coinbase_accounts = coinbase_client.get_accounts(order='asc', limit=100)
-
-        for i, account in enumerate(coinbase_accounts["data"]):
-            print("- #%d %s: %s %s available (currently %s %s)" % (i, account['id'], account['balance'], account['currency'], account['native_balance']['amount'], account['native_balance']['currency']))
-
-            print("--- Getting transactions via API")
-            coinbase_accounts['data'][i]['transactions'] = coinbase_client.get_transactions(account['id'], order='asc', limit=100)
-            pagination = coinbase_accounts['data'][i]['transactions'].pagination
-            page = 2
-            while pagination != None and pagination['next_uri'] != None:
-                print("--- Getting transactions via API (page %d)" % page)
-                starting_after_guid = re.search('starting_after=([0-9a-f]{8}-([0-9a-f]{4}-){3}[0-9a-f]{12})', pagination.next_uri, re.I).group(1)
-                next_page = coinbase_client.get_transactions(account['id'], order='asc', limit=100, starting_after=starting_after_guid)
-                coinbase_accounts['data'][i]['transactions']['data'] = coinbase_accounts['data'][i]['transactions']['data'] + next_page['data']
-                pagination = next_page.pagination
-                page = page + 1
-
-            print("--- Getting buys via API")
-            coinbase_accounts['data'][i]['buys'] = coinbase_client.get_buys(account['id'], order='asc', limit=100)
-            pagination = coinbase_accounts['data'][i]['buys'].pagination
-            page = 2
-            while pagination != None and pagination['next_uri'] != None:
-                print("--- Getting buys via API (page %d)" % page)
-                starting_after_guid = re.search('starting_after=([0-9a-f]{8}-([0-9a-f]{4}-){3}[0-9a-f]{12})', pagination.next_uri, re.I).group(1)
-                next_page = coinbase_client.get_buys(account['id'], order='asc', limit=100, starting_after=starting_after_guid)
-                coinbase_accounts['data'][i]['buys']['data'] = coinbase_accounts['data'][i]['buys']['data'] + next_page['data']
-                pagination = next_page.pagination
-                page = page + 1
-
-            print("--- Getting sells via API")
-            coinbase_accounts['data'][i]['sells'] = coinbase_client.get_sells(account['id'], order='asc', limit=100)
-            pagination = coinbase_accounts['data'][i]['sells'].pagination
-            page = 2
-            while pagination != None and pagination['next_uri'] != None:
-                print("--- Getting sells via API (page %d)" % page)
-                starting_after_guid = re.search('starting_after=([0-9a-f]{8}-([0-9a-f]{4}-){3}[0-9a-f]{12})', pagination.next_uri, re.I).group(1)
-                next_page = coinbase_client.get_sells(account['id'], order='asc', limit=100, starting_after=starting_after_guid)
-                coinbase_accounts['data'][i]['sells']['data'] = coinbase_accounts['data'][i]['sells']['data'] + next_page['data']
-                pagination = next_page.pagination
-                page = page + 1
-
-            print("--- Getting deposits via API")
-            coinbase_accounts['data'][i]['deposits'] = coinbase_client.get_deposits(account['id'], order='asc', limit=100)
-            pagination = coinbase_accounts['data'][i]['deposits'].pagination
-            page = 2
-            while pagination != None and pagination['next_uri'] != None:
-                print("--- Getting deposits via API (page %d)" % page)
-                starting_after_guid = re.search('starting_after=([0-9a-f]{8}-([0-9a-f]{4}-){3}[0-9a-f]{12})', pagination.next_uri, re.I).group(1)
-                next_page = coinbase_client.get_deposits(account['id'], order='asc', limit=100, starting_after=starting_after_guid)
-                coinbase_accounts['data'][i]['deposits']['data'] = coinbase_accounts['data'][i]['deposits']['data'] + next_page['data']
-                pagination = next_page.pagination
-                page = page + 1
-
-            print("--- Getting withdrawals via API")
-            coinbase_accounts['data'][i]['withdrawals'] = coinbase_client.get_withdrawals(account['id'], order='asc', limit=100)
-            pagination = coinbase_accounts['data'][i]['withdrawals'].pagination
-            page = 2
-            while pagination != None and pagination['next_uri'] != None:
-                print("--- Getting withdrawals via API (page %d)" % page)
-                starting_after_guid = re.search('starting_after=([0-9a-f]{8}-([0-9a-f]{4}-){3}[0-9a-f]{12})', pagination.next_uri, re.I).group(1)
-                next_page = coinbase_client.get_withdrawals(account['id'], order='asc', limit=100, starting_after=starting_after_guid)
-                coinbase_accounts['data'][i]['withdrawals']['data'] = coinbase_accounts['data'][i]['withdrawals']['data'] + next_page['data']
-                pagination = next_page.pagination
-                page = page + 1
-
-        print("Storing account data in %scoinbase_accounts.json" % file_prefix)
-        with open('%scoinbase_accounts.json' % file_prefix, 'w') as outfile:
-            json.dump(coinbase_accounts, outfile)
-
-    coinbase_entries = []
+        rate = float(config[exchange].get('rate_limit', rate))
+        burst = int(config[exchange].get('rate_burst', burst))
+    return rate, burst
+
+def rate_budget_key(config, exchange):
+    # both exchanges limit requests per API key, so a batch run shares one budget per API host and key
+    section = config[exchange]
+    return (exchange, urlparse(section.get('api_url', default_api_urls.get(exchange, ''))).netloc, section.get('key', ''))
+
+def get_rate_limiter(config, exchange, cancel_event=None):
+    rate, burst = get_rate_limit(config, exchange)
+    state, lock = None, None
+    if exchange in config.sections() and rate_budget_key(config, exchange) in batch_rate_budgets:
+        state, lock = batch_rate_budgets[rate_budget_key(config, exchange)]
+    return RateLimiter(rate, burst, cancel_event, state, lock)
+
+class Transport:
+    # resilient HTTP layer shared by the exchange adapters. It is installed on a requests session, so every request
+    # made through that session (including those made inside an API connector module) uses a pooled connection,
+    # waits for the exchange's rate limiter and is retried on transient failures (see default_retries). Responses
+    # for which page_complete(params, response) is true, i.e. pages of a paginated endpoint which won't change any
+    # more, are stored in an on-disk response cache keyed by endpoint and cursor, so an interrupted run resumes
+    # from the last completed page instead of starting over. Requests, rate limit waits, retries and response
+    # cache hits are recorded in metrics for the exchange 'name', per endpoint (URL path)
+    def __init__(self, limiter, retries=default_retries, cache_dir=None, cache_ttl=default_response_cache_ttl, page_complete=None, log=print, name=None):
+        self.name = name
+        self.limiter = limiter
+        self.retries = retries
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self.page_complete = page_complete
+        self.log = log
+
+    def install(self, session, pool_size=10):
+        # route all requests of a requests session through this transport, keeping its authentication and headers
+        import requests
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        send = session.request
+        session.request = lambda method, url, **kwargs: self.request(send, method, url, **kwargs)
+        return session
+
+    def request(self, send, method, url, **kwargs):
+        import requests
+        kwargs.setdefault('timeout', request_timeout)
+        endpoint = urlparse(url).path
+        key = None
+        if self.cache_dir != None and self.page_complete != None and method.upper() == 'GET':
+            key = self.cache_key(url, kwargs.get('params'))
+            self.limiter.check_cancelled()
+            response = self.load_response(key)
+            if response != None:
+                metrics.count('response_cache_hits', exchange=self.name, endpoint=endpoint)
+                return response
+
+        attempt = 0
+        while True:
+            with metrics.timer('rate_limit_wait', exchange=self.name):
+                self.limiter.wait()
+            try:
+                with metrics.timer('api_request', exchange=self.name, endpoint=endpoint):
+                    response = send(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                reason = type(e).__name__
+                delay = self.backoff(attempt)
+            else:
+                if response.status_code not in retry_statuses or attempt >= self.retries:
+                    break
+                reason = "HTTP %d" % response.status_code
+                delay = self.backoff(attempt, response.headers.get('Retry-After'))
+            attempt = attempt + 1
+            metrics.count('retries', exchange=self.name, endpoint=endpoint, reason=reason)
+            self.log("--- %s from %s, retrying in %0.1f seconds (retry %d of %d)" % (reason, url, delay, attempt, self.retries))
+            self.limiter.sleep(delay)
+
+        if key != None and response.status_code == 200 and self.page_complete(kwargs.get('params'), response):
+            self.store_response(key, response)
+        return response
+
+    def backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(retry_backoff_max, retry_backoff * 2 ** attempt))
+        if retry_after != None:
+            try:
+                delay = max(delay, min(retry_backoff_max, float(retry_after)))
+            except ValueError:
+                # HTTP date form, not used by the supported exchanges
+                pass
+        return delay
+
+    def cache_key(self, url, params):
+        request = json.dumps([url, params], sort_keys=True)
+        return os.path.join(self.cache_dir, hashlib.sha1(request.encode('utf-8')).hexdigest() + '.json')
+
+    def load_response(self, key):
+        import requests
+        try:
+            with open(key, 'r') as infile:
+                entry = json.load(infile)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['stored'] > self.cache_ttl:
+            return None
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+        response.url = entry['url']
+        response.encoding = 'utf-8'
+        response._content = entry['body'].encode('utf-8')
+        return response
+
+    def store_response(self, key, response):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = { 'stored': time.time(), 'url': response.url, 'status': response.status_code, 'headers': dict(response.headers), 'body': response.text }
+        with atomic_write(key) as outfile:
+            json.dump(entry, outfile)
+
+    def clear_cache(self):
+        # drop cached pages once everything they were needed for has been stored
+        if self.cache_dir != None and os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+            try:
+                # also remove the response cache directory once no other exchange is using it
+                os.rmdir(os.path.dirname(self.cache_dir))
+            except OSError:
+                pass
+
+@contextlib.contextmanager
+def atomic_write(filename, mode='w', **kwargs):
+    # open a file for writing under a temporary name and move it into place only once it is complete, so that an
+    # interrupted run leaves either the previous or the new file behind, never a truncated one
+    temp_filename = '%s.tmp' % filename
+    try:
+        with open(temp_filename, mode, **kwargs) as outfile:
+            yield outfile
+            outfile.flush()
+            os.fsync(outfile.fileno())
+    except:
+        if os.path.isfile(temp_filename):
+            os.remove(temp_filename)
+        raise
+    os.replace(temp_filename, filename)
+
+def load_sync_state(filename):
+    # per-account/endpoint/product high-water marks recorded by the last API fetch, used for incremental runs
+    if os.path.isfile(filename):
+        with open(filename, 'r') as infile:
+            return json.load(infile)
+    return {}
+
+def save_sync_state(filename, sync_state):
+    with atomic_write(filename) as outfile:
+        json.dump(sync_state, outfile)
+
+class Checkpoint:
+    # crash-safe progress journal for one exchange's API download, <prefix><exchange>_checkpoint.jsonl. Each page
+    # of each account/endpoint is appended as soon as it arrives, together with the cursor to continue after it,
+    # so --resume can continue an interrupted download from the last completed page of every endpoint. The first
+    # line records the kind of run, since an incremental download can't be continued as a full one or vice versa
+    def __init__(self, filename, resume=False, incremental=False, log=print):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = {}
+        header = { 'checkpoint': 1, 'incremental': incremental }
+        if resume and os.path.isfile(filename):
+            saved_header, self.entries = self.read()
+            if saved_header != header:
+                log("Checkpoint %s is from a different kind of run, starting over" % filename)
+                self.entries = {}
+            else:
+                done = sum(1 for entry in self.entries.values() if entry['done'])
+                log("Resuming from checkpoint %s (%d endpoints complete, %d partially downloaded)" % (filename, done, len(self.entries) - done))
+        elif resume:
+            log("No checkpoint %s found, starting from the beginning" % filename)
+
+        # start a fresh journal holding only the entries being continued, which also drops a line cut off by a crash
+        with atomic_write(filename) as outfile:
+            outfile.write(json.dumps(header) + '\n')
+            for key, entry in self.entries.items():
+                outfile.write(json.dumps({ 'key': json.loads(key), 'items': entry['items'], 'cursor': entry['cursor'], 'done': entry['done'] }) + '\n')
+        self.journal = open(filename, 'a')
+
+    def read(self):
+        header = None
+        entries = {}
+        with open(self.filename, 'r') as infile:
+            for line in infile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # only partially written when the run was interrupted
+                    break
+                if header == None:
+                    header = record
+                    continue
+                entry = entries.setdefault(json.dumps(record['key']), { 'items': [], 'cursor': None, 'done': False })
+                entry['items'].extend(record['items'])
+                entry['cursor'] = record['cursor']
+                entry['done'] = record['done']
+        return header, entries
+
+    def resume(self, key):
+        # (items, cursor, done) downloaded so far for an endpoint, or None if it hasn't been started
+        entry = self.entries.get(json.dumps(key))
+        if entry == None:
+            return None
+        return list(entry['items']), entry['cursor'], entry['done']
+
+    def record(self, key, items, cursor):
+        # append one page; a cursor of None marks the endpoint as complete
+        line = json.dumps({ 'key': key, 'items': items, 'cursor': cursor, 'done': cursor == None }) + '\n'
+        with self.lock:
+            self.journal.write(line)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def close(self):
+        # stop journaling, keeping the file so --resume can continue from it
+        self.journal.close()
+
+    def remove(self):
+        # called once everything downloaded has been stored in the cache files
+        self.close()
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+def fetch_pages(paginate, cursor=None, checkpoint=None, key=None, labels={}):
+    # collect the items of a paginated download, where paginate(cursor) yields (items, next cursor) per page and
+    # the next cursor is None after the last page. With a checkpoint each page is recorded as it arrives, and an
+    # endpoint downloaded before is continued after its last recorded page (or not requested at all if complete).
+    # Downloaded pages and records are counted in metrics with the given labels
+    items = []
+    if checkpoint != None:
+        saved = checkpoint.resume(key)
+        if saved != None:
+            items, cursor, done = saved
+            if done:
+                return items
+    for page_items, cursor in paginate(cursor):
+        items.extend(page_items)
+        metrics.count('pages', **labels)
+        metrics.count('records', len(page_items), **labels)
+        if checkpoint != None:
+            checkpoint.record(key, page_items, cursor)
+    return items
+
+class ExportError(Exception):
+    # configuration or setup problem which stops an export; status is used as the script's exit code
+    def __init__(self, message, status=1):
+        Exception.__init__(self, message)
+        self.status = status
+
+class ExportCancelled(Exception):
+    # raised inside an exchange export once it has been cancelled, e.g. after its timeout expired
+    pass
+
+class JsonCache:
+    # original cache format: each cache is a single JSON document, e.g. <prefix>coinbase_accounts.json
+    def __init__(self, file_prefix):
+        self.file_prefix = file_prefix
+
+    def filename(self, name):
+        return '%s%s.json' % (self.file_prefix, name)
+
+    def exists(self, name):
+        return os.path.isfile(self.filename(name))
+
+    def load(self, name):
+        with metrics.timer('cache_load', cache=name), open(self.filename(name), 'r') as infile:
+            return json.load(infile)
+
+    def store(self, name, data):
+        with metrics.timer('cache_store', cache=name), atomic_write(self.filename(name)) as outfile:
+            # lazily loaded record lists (see SegmentCache) are written out as plain lists
+            json.dump(data, outfile, default=list)
+
+class LazyRecords(Sequence):
+    # read-only list of cached records decoded on demand from a memory-mapped segment; iterating streams one
+    # record at a time, while indexing decodes (and keeps) the whole segment
+    def __init__(self, segment_map, offset, length, count):
+        self.segment_map = segment_map
+        self.offset = offset
+        self.length = length
+        self.count = count
+        self.records = None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        if self.records != None:
+            yield from self.records
+            return
+        start = self.offset
+        end = self.offset + self.length
+        while start < end:
+            newline = self.segment_map.find(b'\n', start, end)
+            yield json.loads(self.segment_map[start:newline].decode('utf-8'))
+            start = newline + 1
+
+    def __getitem__(self, i):
+        if self.records == None:
+            self.records = list(iter(self))
+        return self.records[i]
+
+class SegmentCache:
+    # segment cache format for large archives: records are appended one JSON document per line to a segment
+    # data file, and a small index maps each account/endpoint (or fill page) to its offset, length and record
+    # count. Loading only decodes account details; record lists are memory-mapped and decoded lazily, so each
+    # account/endpoint can be streamed without reading the whole cache.
+    #
+    # <prefix><name>.idx           index pointing at the current data file
+    # <prefix><name>.<n>.seg       data file, a new generation is written on every store so that records
+    #                              still mapped from the previous one stay valid
+    def __init__(self, file_prefix):
+        self.file_prefix = file_prefix
+        self.maps = []
+
+    def filename(self, name):
+        return '%s%s.idx' % (self.file_prefix, name)
+
+    def exists(self, name):
+        return os.path.isfile(self.filename(name))
+
+    def load(self, name):
+        with metrics.timer('cache_load', cache=name):
+            with open(self.filename(name), 'r') as infile:
+                index = json.load(infile)
+            data_filename = os.path.join(os.path.dirname(self.filename(name)), index['data'])
+            if os.path.getsize(data_filename) > 0:
+                with open(data_filename, 'rb') as infile:
+                    segment_map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps.append(segment_map)
+            else:
+                segment_map = b''
+
+            def pages(key):
+                return [LazyRecords(segment_map, offset, length, count) for offset, length, count in index['segments'].get(key, [])]
+
+            if name == 'coinbase_accounts':
+                coinbase_accounts = { 'data': list(pages('accounts')[0]) }
+                for account in coinbase_accounts['data']:
+                    for resource in coinbase_resources:
+                        if '%s/%s' % (account['id'], resource) in index['segments']:
+                            account[resource] = { 'data': pages('%s/%s' % (account['id'], resource))[0] }
+                return coinbase_accounts
+            elif name == 'gdax_accounts':
+                gdax_accounts = list(pages('accounts')[0])
+                for account in gdax_accounts:
+                    if '%s/history' % account['id'] in index['segments']:
+                        account['history'] = pages('%s/history' % account['id'])
+                return gdax_accounts
+            elif name == 'gdax_fills':
+                return pages('fills')
+            # caches of other exchange adapters are stored as a single document
+            return pages('data')[0][0]
+
+    def store(self, name, data):
+        with metrics.timer('cache_store', cache=name):
+            # split the cache into (key, pages) segments, keeping account details separate from their records
+            if name == 'coinbase_accounts':
+                segments = [('accounts', [[{ k: v for k, v in account.items() if k not in coinbase_resources } for account in data['data']]])]
+                for account in data['data']:
+                    segments.extend(('%s/%s' % (account['id'], resource), [account[resource]['data']]) for resource in coinbase_resources if resource in account)
+            elif name == 'gdax_accounts':
+                segments = [('accounts', [[{ k: v for k, v in account.items() if k != 'history' } for account in data]])]
+                segments.extend(('%s/history' % account['id'], account['history']) for account in data if 'history' in account)
+            elif name == 'gdax_fills':
+                segments = [('fills', data)]
+            else:
+                segments = [('data', [[data]])]
+
+            index_filename = self.filename(name)
+            generation = 1
+            if os.path.isfile(index_filename):
+                with open(index_filename, 'r') as infile:
+                    generation = json.load(infile)['generation'] + 1
+            data_filename = '%s%s.%d.seg' % (self.file_prefix, name, generation)
+
+            index = { 'data': os.path.basename(data_filename), 'generation': generation, 'segments': {} }
+            with atomic_write(data_filename, 'wb') as outfile:
+                offset = 0
+                for key, pages in segments:
+                    index['segments'][key] = []
+                    for page in pages:
+                        count = 0
+                        length = 0
+                        for record in page:
+                            line = (json.dumps(record) + '\n').encode('utf-8')
+                            outfile.write(line)
+                            length = length + len(line)
+                            count = count + 1
+                        index['segments'][key].append([offset, length, count])
+                        offset = offset + length
+            # the index is replaced last, so it only ever points at a complete data file
+            with atomic_write(index_filename) as outfile:
+                json.dump(index, outfile)
+
+            # remove older generations, which may still be mapped (and therefore locked on Windows) until exit
+            for old_generation in range(1, generation):
+                old_filename = '%s%s.%d.seg' % (self.file_prefix, name, old_generation)
+                if os.path.isfile(old_filename):
+                    try:
+                        os.remove(old_filename)
+                    except OSError:
+                        pass
+
+def get_cache(config, file_prefix):
+    # cache backend selected with 'cache' in the [files] section: 'json' (default) or 'segments'
+    backend = 'json'
+    if 'files' in config.sections() and 'cache' in config['files']:
+        backend = config['files']['cache']
+    if backend == 'json':
+        return JsonCache(file_prefix)
+    elif backend == 'segments':
+        return SegmentCache(file_prefix)
+    raise ExportError("Unknown cache backend '%s', must be 'json' or 'segments'" % backend)
+
+def merge_records(existing, new, key=lambda record: record['id']):
+    # merge newly fetched records into previously cached ones, replacing duplicates in place and appending the rest
+    merged = list(existing)
+    positions = { key(record): i for i, record in enumerate(merged) }
+    for record in new:
+        record_key = key(record)
+        if record_key in positions:
+            merged[positions[record_key]] = record
+        else:
+            positions[record_key] = len(merged)
+            merged.append(record)
+    return merged
+
+def paginate_coinbase(get_resource, account_id, starting_after=None, label='records', log=print):
+    # generator yielding the records of a Coinbase list endpoint in ascending order one page at a time, each with
+    # the starting_after GUID of the next page (None after the last page); if a starting_after GUID is given, only
+    # records newer than that one are returned
+    params = { 'order': 'asc', 'limit': 100 }
+    page = 1
+    while True:
+        if starting_after != None:
+            params['starting_after'] = starting_after
+        if page > 1:
+            log("--- Getting %s for %s via API (page %d)" % (label, account_id, page))
+        elif starting_after != None:
+            log("--- Getting %s for %s via API (after %s)" % (label, account_id, starting_after))
+        else:
+            log("--- Getting %s for %s via API" % (label, account_id))
+        result = get_resource(account_id, **params)
+
+        pagination = result.pagination
+        if pagination == None or pagination['next_uri'] == None:
+            yield result['data'], None
+            return
+        starting_after = starting_after_pattern.search(pagination['next_uri']).group(1)
+        yield result['data'], starting_after
+        page = page + 1
+
+def cancel_futures(futures):
+    # cancel every queued (not yet running) future in a possibly nested list
+    for future in futures:
+        if isinstance(future, list):
+            cancel_futures(future)
+        elif future != None:
+            future.cancel()
+
+def fetch_coinbase_resource(coinbase_client, account_id, resource, starting_after=None, log=print, checkpoint=None):
+    # fetch every record of one resource type (transactions, buys, etc.) for one account, in the cached layout
+    get_resource = getattr(coinbase_client, 'get_%s' % resource)
+    paginate = lambda cursor: paginate_coinbase(get_resource, account_id, cursor, resource, log)
+    return { 'data': fetch_pages(paginate, starting_after, checkpoint, [account_id, resource], { 'exchange': 'coinbase', 'account': account_id, 'endpoint': resource }) }
+
+def fetch_coinbase_accounts(coinbase_client, workers, sync_marks={}, log=print, checkpoint=None):
+    # fetch the account list, then every resource type for every account using a bounded pool of worker threads;
+    # sync_marks maps account ID -> resource -> last seen record GUID for incremental fetches
+    coinbase_accounts = coinbase_client.get_accounts(order='asc', limit=100)
+    for i, account in enumerate(coinbase_accounts["data"]):
+        log("- #%d %s: %s %s available (currently %s %s)" % (i, account['id'], account['balance'], account['currency'], account['native_balance']['amount'], account['native_balance']['currency']))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [[executor.submit(fetch_coinbase_resource, coinbase_client, account['id'], resource, sync_marks.get(account['id'], {}).get(resource), log, checkpoint) for resource in coinbase_resources] for account in coinbase_accounts['data']]
+
+        # attach results in account/resource order so the cached structure is identical to a serial fetch
+        try:
+            for i, account_futures in enumerate(futures):
+                for resource, future in zip(coinbase_resources, account_futures):
+                    coinbase_accounts['data'][i][resource] = future.result()
+        except:
+            # don't keep fetching the remaining resources once one has failed
+            cancel_futures(futures)
+            raise
+
+    return coinbase_accounts
+
+def coinbase_page_complete(params, response):
+    # pages of a Coinbase list endpoint are requested in ascending order, so every page except the last is final
+    pagination = response.json().get('pagination')
+    return pagination != None and pagination.get('next_uri') != None
+
+def merge_coinbase_accounts(cached_accounts, coinbase_accounts):
+    # merge incrementally fetched Coinbase resources into the cached account data, deduplicating by record ID
+    cached_by_id = { account['id']: account for account in cached_accounts['data'] }
+    for account in coinbase_accounts['data']:
+        if account['id'] not in cached_by_id:
+            continue
+        for resource in coinbase_resources:
+            account[resource]['data'] = merge_records(cached_by_id[account['id']][resource]['data'], account[resource]['data'])
+    return coinbase_accounts
+
+def coinbase_sync_marks(coinbase_accounts):
+    # records are fetched in ascending order, so the last record of each resource is the newest one
+    sync_marks = {}
+    for account in coinbase_accounts['data']:
+        sync_marks[account['id']] = { resource: account[resource]['data'][-1]['id'] for resource in coinbase_resources if len(account[resource]['data']) > 0 }
+    return sync_marks
+
+def merge_pages(cached_pages, new_pages, key=lambda entry: entry['id']):
+    # merge newly fetched pages of GDAX entries into cached ones, adding unseen entries as a single leading page
+    known_keys = set(key(entry) for page in cached_pages for entry in page)
+    new_entries = []
+    for page in new_pages:
+        for entry in page:
+            if key(entry) not in known_keys:
+                known_keys.add(key(entry))
+                new_entries.append(entry)
+    return ([new_entries] if len(new_entries) > 0 else []) + cached_pages
+
+def gdax_sync_mark(pages, field):
+    # GDAX ledger IDs and fill trade IDs increase over time, so the largest one is the newest; ledger IDs are
+    # returned as strings, so they are compared as numbers
+    values = [entry[field] for page in pages for entry in page]
+    return max(values, key=int) if len(values) > 0 else None
+
+def gdax_get(gdax_auth_client, session, path, params=None):
+    # GET a GDAX endpoint through the transport session, returning the response and its decoded JSON; the gdax
+    # module makes its own requests without a session and returns errors as data, so this is used instead
+    r = session.get(gdax_auth_client.url + path, params=params, auth=gdax_auth_client.auth)
+    if r.status_code != 200:
+        try:
+            message = r.json().get('message')
+        except ValueError:
+            message = r.text
+        raise Exception("GDAX API error for %s: HTTP %d %s" % (path, r.status_code, message))
+    return r, r.json()
+
+def gdax_page_complete(params, response):
+    # GDAX pages reached through a cursor don't change once there is a next one; the newest page (no cursor) and
+    # the last page of a forward walk can still gain entries
+    if params == None:
+        return False
+    if 'after' in params:
+        return 'cb-after' in response.headers
+    if 'before' in params:
+        return len(response.json()) >= gdax_page_size
+    return False
+
+def paginate_gdax(gdax_auth_client, session, path, params={}, after=None):
+    # generator paging backwards from the newest entry (or from an 'after' cursor) of a GDAX ledger or fills
+    # endpoint, for fetch_pages(); collects the same pages as the gdax module: the first page even if it is
+    # empty, then every non-empty older page
+    params = dict(params)
+    if after == None:
+        r, page = gdax_get(gdax_auth_client, session, path, params)
+        after = r.headers.get('cb-after')
+        yield [page], after
+    while after != None:
+        params['after'] = after
+        r, page = gdax_get(gdax_auth_client, session, path, params)
+        after = r.headers.get('cb-after')
+        yield [page] if len(page) > 0 else [], after
+
+def paginate_gdax_newer(gdax_auth_client, session, path, before, params={}):
+    # generator paging forward from a known cursor on a GDAX ledger or fills endpoint, for fetch_pages();
+    # collects pages of newer entries
+    params = dict(params)
+    while True:
+        params['before'] = before
+        params['limit'] = gdax_page_size
+        r, page = gdax_get(gdax_auth_client, session, path, params)
+        if len(page) == 0:
+            yield [], None
+            return
+        if len(page) < gdax_page_size or 'cb-before' not in r.headers:
+            yield [page], None
+            return
+        before = r.headers['cb-before']
+        yield [page], before
+
+def gdax_held_currencies(gdax_accounts):
+    # currencies with a balance or any ledger activity; every fill creates ledger entries for both sides of
+    # the product, so products involving any other currency cannot have fills
+    held_currencies = set()
+    for account in gdax_accounts:
+        if float(account['balance']) != 0 or any(len(page) > 0 for page in account['history']):
+            held_currencies.add(account['currency'])
+    return held_currencies
+
+def fetch_gdax_product_fills(gdax_auth_client, session, product_id, fill_mark=None, log=print, checkpoint=None):
+    # fetch all fill pages for one product, or only newer ones if the last seen trade ID is known
+    if fill_mark != None:
+        log("Requesting fills for product %s after trade %s" % (product_id, fill_mark))
+        paginate = lambda before: paginate_gdax_newer(gdax_auth_client, session, '/fills', before, { 'product_id': product_id })
+        return fetch_pages(paginate, fill_mark, checkpoint, ['fills', product_id], { 'exchange': 'gdax', 'product': product_id, 'endpoint': 'fills' })
+    log("Requesting fills for product %s" % product_id)
+    paginate = lambda after: paginate_gdax(gdax_auth_client, session, '/fills', { 'product_id': product_id }, after)
+    return fetch_pages(paginate, None, checkpoint, ['fills', product_id], { 'exchange': 'gdax', 'product': product_id, 'endpoint': 'fills' })
+
+def fetch_gdax_fills(gdax_auth_client, session, workers, products, held_currencies, fill_marks={}, log=print, checkpoint=None):
+    # fetch fills for all products concurrently using a bounded pool of worker threads, skipping products
+    # that can't have any fills according to held_currencies (see gdax_held_currencies(), None fetches every
+    # product); pages are merged in product order so the result is deterministic
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for product in products:
+            base_currency, quote_currency = product["id"].split('-')
+            if held_currencies != None and (base_currency not in held_currencies or quote_currency not in held_currencies):
+                log("Skipping fills for product %s (%s and %s have not both been held)" % (product["id"], base_currency, quote_currency))
+                futures.append(None)
+            else:
+                futures.append(executor.submit(fetch_gdax_product_fills, gdax_auth_client, session, product["id"], fill_marks.get(product["id"]), log, checkpoint))
+
+        gdax_fills = []
+        try:
+            for future in futures:
+                if future == None:
+                    # same single empty page the API returns for a product without fills
+                    gdax_fills.append([])
+                else:
+                    gdax_fills.extend(future.result())
+        except:
+            cancel_futures(futures)
+            raise
+    return gdax_fills
+
+def parse_timestamp(value):
+    # ISO 8601 timestamp -> integer microseconds since the epoch (UTC)
+    match = timestamp_pattern.match(value)
+    if match == None:
+        raise ValueError("Unrecognized timestamp '%s'" % value)
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    epoch = calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second), 0, 0, 0)) * 1000000
+    if fraction != None:
+        epoch = epoch + int(fraction.ljust(6, '0'))
+    if zone != None and zone != 'Z':
+        offset = (int(zone[1:3]) * 60 + int(zone[-2:])) * 60000000
+        epoch = epoch - offset if zone[0] == '+' else epoch + offset
+    return epoch
+
+class RecordStore:
+    # compact columnar store for normalized export records: timestamps are pre-parsed to integer epoch
+    # microseconds for sorting, amounts are kept as exact Decimals, currencies/types/exchanges are stored as
+    # small integer codes, and nothing is formatted as text until the rows are written out
+    __slots__ = ['epochs', 'dates', 'buy_amounts', 'buy_currencies', 'sell_amounts', 'sell_currencies',
+                 'fee_amounts', 'fee_currencies', 'trade_ids', 'comments', 'types', 'exchanges', 'codes', 'values']
+
+    def __init__(self):
+        self.epochs = array('q')
+        self.dates = []
+        self.buy_amounts = []
+        self.buy_currencies = array('H')
+        self.sell_amounts = []
+        self.sell_currencies = array('H')
+        self.fee_amounts = []
+        self.fee_currencies = array('H')
+        self.trade_ids = []
+        self.comments = []
+        self.types = array('H')
+        self.exchanges = array('H')
+        self.codes = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def code(self, value):
+        # small integer code for a frequently repeated string value
+        code = self.codes.get(value)
+        if code == None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def append(self, date, buy_amount, buy_currency, sell_amount, sell_currency, fee_amount, fee_currency, trade_id, comment, type, exchange):
+        self.epochs.append(parse_timestamp(date))
+        self.dates.append(date)
+        self.buy_amounts.append(buy_amount)
+        self.buy_currencies.append(self.code(buy_currency))
+        self.sell_amounts.append(sell_amount)
+        self.sell_currencies.append(self.code(sell_currency))
+        self.fee_amounts.append(fee_amount)
+        self.fee_currencies.append(self.code(fee_currency))
+        self.trade_ids.append(trade_id)
+        self.comments.append(comment)
+        self.types.append(self.code(type))
+        self.exchanges.append(self.code(exchange))
+
+    def codes_for(self, column):
+        # codes for a whole column of string values, adding new values first
+        for value in set(column):
+            self.code(value)
+        return map(self.codes.__getitem__, column)
+
+    def extend(self, dates, buy_amounts, buy_currencies, sell_amounts, sell_currencies, fee_amounts, fee_currencies, trade_ids, comments, types, exchanges):
+        # append many records at once, given as equally long columns in append() argument order
+        self.epochs.extend(map(parse_timestamp, dates))
+        self.dates.extend(dates)
+        self.buy_amounts.extend(buy_amounts)
+        self.buy_currencies.extend(self.codes_for(buy_currencies))
+        self.sell_amounts.extend(sell_amounts)
+        self.sell_currencies.extend(self.codes_for(sell_currencies))
+        self.fee_amounts.extend(fee_amounts)
+        self.fee_currencies.extend(self.codes_for(fee_currencies))
+        self.trade_ids.extend(trade_ids)
+        self.comments.extend(comments)
+        self.types.extend(self.codes_for(types))
+        self.exchanges.extend(self.codes_for(exchanges))
+
+    def row(self, i):
+        # formatted output row for one record
+        values = self.values
+        return [
+            self.dates[i],
+            format(self.buy_amounts[i], 'f'),
+            values[self.buy_currencies[i]],
+            format(self.sell_amounts[i], 'f'),
+            values[self.sell_currencies[i]],
+            format(self.fee_amounts[i], 'f'),
+            values[self.fee_currencies[i]],
+            self.trade_ids[i],
+            self.comments[i],
+            values[self.types[i]],
+            values[self.exchanges[i]]]
+
+    def sorted_indexes(self):
+        # record positions in timestamp order (stable for identical timestamps)
+        return sorted(range(len(self.epochs)), key=self.epochs.__getitem__)
+
+    def sorted_rows(self):
+        # formatted output rows in timestamp order
+        for i in self.sorted_indexes():
+            yield self.row(i)
+
+class ExportWriter:
+    # collects export records and writes them to a CSV file in timestamp order when closed; at most
+    # sort_buffer records are held in memory, beyond that each full buffer is sorted and spilled to a
+    # temporary run file, and the runs are k-way merged by timestamp while writing the output. Sorting, spilling
+    # and writing are timed in metrics with the given labels
+    def __init__(self, filename, sort_buffer=default_sort_buffer, labels={}):
+        self.filename = filename
+        self.sort_buffer = sort_buffer
+        self.labels = labels
+        self.records = RecordStore()
+        self.runs = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, *row):
+        self.records.append(*row)
+        self.count = self.count + 1
+        if len(self.records) >= self.sort_buffer:
+            self.spill()
+
+    def extend(self, *columns):
+        # append records given as columns (see RecordStore.extend()), spilling whenever the buffer fills up
+        start = 0
+        while start < len(columns[0]):
+            end = min(len(columns[0]), start + max(1, self.sort_buffer - len(self.records)))
+            self.records.extend(*[column[start:end] for column in columns])
+            self.count = self.count + end - start
+            start = end
+            if len(self.records) >= self.sort_buffer:
+                self.spill()
+
+    def spill(self):
+        # write the buffered records to a sorted run file, each row prefixed with its epoch timestamp
+        with metrics.timer('sort', **self.labels):
+            indexes = self.records.sorted_indexes()
+        with metrics.timer('spill', **self.labels):
+            run = tempfile.TemporaryFile(mode='w+', newline='', encoding='utf-8', buffering=write_buffer_size)
+            writer = csv.writer(run, lineterminator='\n')
+            epochs = self.records.epochs
+            for i in indexes:
+                writer.writerow([epochs[i]] + self.records.row(i))
+            run.seek(0)
+        self.runs.append(run)
+        self.records = RecordStore()
+
+    def read_run(self, run):
+        for row in csv.reader(run):
+            yield int(row[0]), row[1:]
+
+    def close(self):
+        with metrics.timer('sort', **self.labels):
+            indexes = self.records.sorted_indexes()
+        if len(self.runs) > 0:
+            # merge is stable, and runs are in append order, so ties keep their original order
+            epochs = self.records.epochs
+            buffered = ((epochs[i], self.records.row(i)) for i in indexes)
+            rows = (row for epoch, row in heapq.merge(*[self.read_run(run) for run in self.runs], buffered, key=lambda item: item[0]))
+        else:
+            rows = (self.records.row(i) for i in indexes)
+
+        with metrics.timer('write', **self.labels), atomic_write(self.filename, 'w', newline='', encoding='utf-8', buffering=write_buffer_size) as outfile:
+            writer = csv.writer(outfile, lineterminator='\n')
+            writer.writerow(export_header)
+            writer.writerows(rows)
+
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.records = RecordStore()
+
+class RecordIndex:
+    # per-account ID -> record lookup for cross-references between Coinbase resources (buys, sells, deposits,
+    # withdrawals), each index built once on first use instead of scanning the records for every lookup
+    def __init__(self, account):
+        self.account = account
+        self.indexes = {}
+
+    def get(self, resource, record_id):
+        if resource not in self.indexes:
+            self.indexes[resource] = { record['id']: record for record in self.account[resource]['data'] }
+        return self.indexes[resource].get(record_id)
+
+def normalize_coinbase_accounts(coinbase_accounts, coinbase_entries, log=print):
+    # convert cached Coinbase account data into export records
     for z, account in enumerate(coinbase_accounts['data']):
         if account['currency'] not in ['BTC', 'ETH', 'LTC', 'BCH']:
             # skip non-crypto accounts, native currencies are handled as part of buy/sell transactions
@@ -191,17 +1091,17 @@ if 'coinbase' in queued_exchanges:
                 continue
             row = [
                 buy['created_at'],
-                buy['amount']['amount'],
+                Decimal(buy['amount']['amount']),
                 buy['amount']['currency'],
-                buy['total']['amount'],
+                Decimal(buy['total']['amount']),
                 buy['total']['currency'],
-                '%0.8f' % (float(buy['total']['amount']) - float(buy['subtotal']['amount'])),
+                amount_context.subtract(Decimal(buy['total']['amount']), Decimal(buy['subtotal']['amount'])).quantize(places_8, context=amount_context),
                 buy['total']['currency'],
                 buy['id'],
                 'Reference: %s' % buy['user_reference'],
                 'trade',
                 'Coinbase']
-            coinbase_entries.append(row)
+            coinbase_entries.append(*row)
             #pprint.pprint(buy)
             #print(','.join('%s' % x for x in row))
 
@@ -210,46 +1110,47 @@ if 'coinbase' in queued_exchanges:
                 continue
             row = [
                 sell['created_at'],
-                sell['total']['amount'],
+                Decimal(sell['total']['amount']),
                 sell['total']['currency'],
-                sell['amount']['amount'],
+                Decimal(sell['amount']['amount']),
                 sell['amount']['currency'],
-                '%0.8f' % (float(sell['subtotal']['amount']) - float(sell['total']['amount'])),
+                amount_context.subtract(Decimal(sell['subtotal']['amount']), Decimal(sell['total']['amount'])).quantize(places_8, context=amount_context),
                 sell['total']['currency'],
                 sell['id'],
                 'Reference: %s' % sell['user_reference'],
                 'trade',
                 'Coinbase']
-            coinbase_entries.append(row)
+            coinbase_entries.append(*row)
             #pprint.pprint(sell)
             #print(','.join('%s' % x for x in row))
 
+        related_records = RecordIndex(account)
         for i, transaction in enumerate(account['transactions']['data']):
             if transaction['status'] in ['canceled']:
                 continue
-            row = [transaction['created_at'], 0, '', 0, '', 0, '', transaction['id'], 'Native %s %s' % (transaction['native_amount']['amount'], transaction['native_amount']['currency']), '', 'Coinbase']
+            row = [transaction['created_at'], zero, '', zero, '', zero, '', transaction['id'], 'Native %s %s' % (transaction['native_amount']['amount'], transaction['native_amount']['currency']), '', 'Coinbase']
             if transaction['type'] == 'buy':
                 # incoming fiat currency associated with buy transaction
-                row[1] = transaction['native_amount']['amount']
+                row[1] = Decimal(transaction['native_amount']['amount'])
                 row[2] = row[4] = row[6] = transaction['native_amount']['currency']
                 row[8] = "Deposit for %s %s buy from %s" % (transaction['amount']['amount'], transaction['amount']['currency'], transaction['details']['payment_method_name'])
                 row[9] = 'deposit'
             elif transaction['type'] == 'sell':
                 # outgoing fiat currency associated with sell transaction
-                row[3] = transaction['native_amount']['amount']
+                row[3] = Decimal(transaction['native_amount']['amount'])
                 row[2] = row[4] = row[6] = transaction['native_amount']['currency']
                 row[8] = "Withdrawal from %s %s sell into %s" % (transaction['amount']['amount'], transaction['amount']['currency'], transaction['details']['payment_method_name'])
                 row[9] = 'withdrawal'
             elif transaction['type'] == 'send':
                 if 'to' in transaction:
                     # withdrawal (outgoing funds)
-                    row[3] = '%0.8f' % -float(transaction['amount']['amount'])
+                    row[3] = amount_context.minus(Decimal(transaction['amount']['amount'])).quantize(places_8, context=amount_context)
                     row[2] = row[4] = transaction['amount']['currency']
                     row[8] = row[8] + (': To %s' % transaction['to']['resource'])
                     row[9] = 'withdrawal'
                 else:
                     # deposit (incoming funds)
-                    row[1] = '%0.8f' % float(transaction['amount']['amount'])
+                    row[1] = Decimal(transaction['amount']['amount']).quantize(places_8, context=amount_context)
                     row[2] = row[4] = transaction['amount']['currency']
                     row[8] = row[8] + (': From %s' % transaction['from']['resource'])
                     row[9] = 'deposit'
@@ -257,32 +1158,31 @@ if 'coinbase' in queued_exchanges:
                         # strange transaction, could be a referral bonus or an oddly categorized deposit
                         # this should NOT be necessary as far as I can tell from the API docs, but it is for corner cases
                         if 'buy' in transaction:
-                            buy_transaction_id = transaction['buy']['resource_path'].split('/')[-1]
-                            for t2 in account['buys']['data']:
-                                if t2['id'] == buy_transaction_id:
-                                    row[1] = transaction['native_amount']['amount']
-                                    row[2] = row[4] = row[6] = transaction['native_amount']['currency']
-                                    row[5] = '%0.8f' % (float(t2['total']['amount']) - float(t2['subtotal']['amount'])),
-                                    row[8] = "Deposit for %s %s buy from unexpected payment source" % (transaction['amount']['amount'], transaction['amount']['currency'])
+                            t2 = related_records.get('buys', transaction['buy']['resource_path'].split('/')[-1])
+                            if t2 != None:
+                                row[1] = Decimal(transaction['native_amount']['amount'])
+                                row[2] = row[4] = row[6] = transaction['native_amount']['currency']
+                                row[5] = amount_context.subtract(Decimal(t2['total']['amount']), Decimal(t2['subtotal']['amount'])).quantize(places_8, context=amount_context)
+                                row[8] = "Deposit for %s %s buy from unexpected payment source" % (transaction['amount']['amount'], transaction['amount']['currency'])
             elif transaction['type'] in ['pro_withdrawal', 'pro_deposit', 'exchange_deposit', 'exchange_withdrawal', 'fiat_deposit', 'fiat_withdrawal', 'order']:
                 row[8] = row[8] + (': %s %s' % (transaction['details']['title'], transaction['details']['subtitle']))
-                if float(transaction['amount']['amount']) < 0:
+                if Decimal(transaction['amount']['amount']) < 0:
                     # withdrawal (outgoing funds)
-                    row[3] = '%0.8f' % -float(transaction['amount']['amount'])
+                    row[3] = amount_context.minus(Decimal(transaction['amount']['amount'])).quantize(places_8, context=amount_context)
                     row[2] = row[4] = transaction['amount']['currency']
                     row[9] = 'withdrawal'
                 else:
                     # deposit (incoming funds)
-                    row[1] = '%0.8f' % float(transaction['amount']['amount'])
+                    row[1] = Decimal(transaction['amount']['amount']).quantize(places_8, context=amount_context)
                     row[2] = row[4] = transaction['amount']['currency']
                     row[9] = 'deposit'
             else:
                 # unknown transaction type, maybe they changed their API or something
-                print("%s has unknown transaction type '%s'" % (row[7], transaction['type']))
-                pprint.pprint(transaction)
+                log("%s has unknown transaction type '%s'" % (row[7], transaction['type']))
+                log(pprint.pformat(transaction))
                 continue
 
-            coinbase_entries.append(row)
+            coinbase_entries.append(*row)
             #pprint.pprint(transaction)
             #print(','.join('%s' % x for x in row))
 
@@ -292,86 +1192,58 @@ if 'coinbase' in queued_exchanges:
         #for i, withdrawal in enumerate(account['withdrawals']['data']):
             #pprint.pprint(withdrawal)
 
-    coinbase_transactions_count = len(coinbase_entries)
-    print("- Processed %d transactions for all accounts" % coinbase_transactions_count)
-    print("- Total of %d records obtained from Coinbase" % len(coinbase_entries))
-
-    with open('%scoinbase_transactions.csv' % file_prefix, 'w') as outfile:
-        outfile.write('Trade date,Buy amount,Buy currency,Sell amount,Sell currency,Fee amount,Fee currency,Trade ID,Comment,Type\n')
-        for row in sorted(coinbase_entries, key=lambda row: row[0]):
-            outfile.write('%s\n' % ','.join(['%s' % x for x in row]))
-
-# GDAX EXPORT
-if 'gdax' in queued_exchanges:
-    import gdax
-    if not set(['passphrase', 'key', 'secret']).issubset(set(config['gdax'])):
-        print("GDAX configuration requires 'passphrase', 'key', and 'secret' values")
-        sys.exit(3)
-
-    print("Creating authenticated GDAX client")
-    gdax_auth_client = gdax.AuthenticatedClient(config['gdax']['key'], config['gdax']['secret'], config['gdax']['passphrase'])
-    products = gdax_auth_client.get_products()
-
-    if args.local and os.path.isfile('%sgdax_accounts.json' % file_prefix):
-        print("Reading GDAX account details from %sgdax_accounts.json" % file_prefix)
-        with open('%sgdax_accounts.json' % file_prefix, 'r') as infile:
-            gdax_accounts = json.load(infile)
-    else:
-        print("Getting GDAX account list via API")
-        gdax_accounts = gdax_auth_client.get_accounts()
-
-        print("- GDAX profile %s" % (gdax_accounts[0]['profile_id']))
-        for i, account in enumerate(gdax_accounts):
-            print("- #%d %s: %0.16f %s available (%0.16f %s on hold), getting account history via API" % (i, account['id'], float(account['available']), account['currency'], float(account['hold']), account['currency']))
-            gdax_accounts[i]['history'] = gdax_auth_client.get_account_history(account['id'])
-
-        print("Storing account history in %sgdax_accounts.json" % file_prefix)
-        with open('%sgdax_accounts.json' % file_prefix, 'w') as outfile:
-            json.dump(gdax_accounts, outfile)
-
-    if args.local and os.path.isfile('%sgdax_fills.json' % file_prefix):
-        print("Reading GDAX fill details from %sgdax_fills.json" % file_prefix)
-        with open('%sgdax_fills.json' % file_prefix, 'r') as infile:
-            gdax_fills = json.load(infile)
-    else:
-        gdax_fills = []
-        print("Getting GDAX order fill history via API")
-        for product in products:
-            print("Requesting fills for product", product["id"])
-            gdax_fills = gdax_fills + gdax_auth_client.get_fills(product_id=product["id"])
-
-        print("Storing fill history in %sgdax_fills.json" % file_prefix)
-        with open('%sgdax_fills.json' % file_prefix, 'w') as outfile:
-            json.dump(gdax_fills, outfile)
-
-    gdax_entries = []
-    for i, fill_page in enumerate(gdax_fills):
-        for j, fill in enumerate(fill_page):
-            row = [fill['created_at'], 0, 'XYZ', 0, 'XYZ', fill['fee'], 'XYZ', '%s-%s' % (fill['order_id'], fill['trade_id']), 'USD volume: $%f' % float(fill['usd_volume']), 'trade', 'GDAX']
-            buy_cur, sell_cur = fill['product_id'].split('-')
-            row[6] = sell_cur
-            if fill['side'] == 'buy':
-                row[1] = fill['size']
-                row[2] = buy_cur
-                row[3] = '%0.8f' % ((float(fill['size']) * float(fill['price'])) + float(fill['fee']))
-                row[4] = sell_cur
-            else:
-                row[1] = '%0.8f' % ((float(fill['size']) * float(fill['price'])) - float(fill['fee']))
-                row[2] = sell_cur
-                row[3] = fill['size']
-                row[4] = buy_cur
 
-            gdax_entries.append(row)
-            #pprint.pprint(fill)
-            #print(','.join('%s' % x for x in row))
+def normalize_gdax_fills(gdax_fills, gdax_entries):
+    # convert cached GDAX order fills into export records, a chunk of fills at a time so memory use doesn't grow
+    # with the size of the history (pages merged by an incremental run can be much larger than API pages)
+    chunk = []
+    for fill_page in gdax_fills:
+        for fill in fill_page:
+            chunk.append(fill)
+            if len(chunk) == normalize_chunk_size:
+                normalize_gdax_fill_chunk(chunk, gdax_entries)
+                chunk = []
+    normalize_gdax_fill_chunk(chunk, gdax_entries)
+
+def normalize_gdax_fill_chunk(fills, gdax_entries):
+    # column-wise conversion of a list of fills: every amount is parsed into an exact Decimal once, and the
+    # totals are computed over whole columns before the records are appended in bulk
+    sizes = list(map(Decimal, [fill['size'] for fill in fills]))
+    prices = list(map(Decimal, [fill['price'] for fill in fills]))
+    fees = list(map(Decimal, [fill['fee'] for fill in fills]))
+    buys = [fill['side'] == 'buy' for fill in fills]
+
+    # quote currency paid for a buy including the fee, or received for a sell after the fee
+    with localcontext(amount_context):
+        totals = [(size * price + fee if buy else size * price - fee).quantize(places_8) for size, price, fee, buy in zip(sizes, prices, fees, buys)]
 
-    gdax_fills_count = len(gdax_entries)
-    print("- Processed %d order fills for all accounts" % gdax_fills_count)
+    # base and quote currencies of each product, e.g. BTC-USD -> BTC, USD
+    product_currencies = {}
+    for product_id in set(fill['product_id'] for fill in fills):
+        buy_cur, sell_cur = product_id.split('-')
+        product_currencies[product_id] = (buy_cur, sell_cur)
+    base_currencies = [product_currencies[fill['product_id']][0] for fill in fills]
+    quote_currencies = [product_currencies[fill['product_id']][1] for fill in fills]
 
+    gdax_entries.extend(
+        [fill['created_at'] for fill in fills],
+        [size if buy else total for size, total, buy in zip(sizes, totals, buys)],
+        [base if buy else quote for base, quote, buy in zip(base_currencies, quote_currencies, buys)],
+        [total if buy else size for size, total, buy in zip(sizes, totals, buys)],
+        [quote if buy else base for base, quote, buy in zip(base_currencies, quote_currencies, buys)],
+        fees,
+        quote_currencies,
+        ['%s-%s' % (fill['order_id'], fill['trade_id']) for fill in fills],
+        ['USD volume: $%f' % float(fill['usd_volume']) for fill in fills],
+        ['trade'] * len(fills),
+        ['GDAX'] * len(fills))
+
+def normalize_gdax_accounts(gdax_accounts, gdax_entries):
+    # convert cached GDAX account history into export records (transfers only, trades come from fills)
     for z, account in enumerate(gdax_accounts):
         for i, transaction_page in enumerate(account['history']):
             for j, transaction in enumerate(transaction_page):
-                row = [transaction['created_at'], 0, account['currency'], 0, account['currency'], 0, account['currency'], '', '', '', 'GDAX']
+                row = [transaction['created_at'], zero, account['currency'], zero, account['currency'], zero, account['currency'], '', '', '', 'GDAX']
                 if transaction['type'] == 'match':
                     continue
                 elif transaction['type'] == 'fee':
@@ -380,23 +1252,671 @@ if 'gdax' in queued_exchanges:
                     row[7] = '%s' % (transaction['details']['transfer_id'])
                     if transaction['details']['transfer_type'] == 'deposit':
                         row[9] = 'deposit'
-                        row[1] = '%0.16f' % float(transaction['amount'])
+                        row[1] = Decimal(transaction['amount']).quantize(places_16, context=amount_context)
                     elif transaction['details']['transfer_type'] == 'withdraw':
                         row[9] = 'withdrawal'
-                        row[3] = '%0.16f' % -float(transaction['amount'])
+                        row[3] = amount_context.minus(Decimal(transaction['amount'])).quantize(places_16, context=amount_context)
                 else:
                     # unknown transaction type, maybe they changed their API or something
                     continue
 
-                gdax_entries.append(row)
+                gdax_entries.append(*row)
                 #pprint.pprint(transaction)
                 #print(','.join('%s' % x for x in row))
 
-    gdax_transfers_count = len(gdax_entries) - gdax_fills_count
-    print("- Processed %d transfers for all accounts" % gdax_transfers_count)
-    print("- Total of %d records obtained from GDAX" % len(gdax_entries))
+class ExchangeAdapter:
+    # base class for exchange plugins. Built-in adapters are listed in builtin_exchanges, and other packages
+    # can add more through the 'crypto_export.exchanges' entry point group, e.g.:
+    #
+    #   [options.entry_points]
+    #   crypto_export.exchanges =
+    #       binance = crypto_export_binance:BinanceExchange
+    #
+    # Adapters must not import their API connector modules at import time, only in create_client(), so
+    # that nothing is imported for exchanges which aren't part of the current job.
+    name = None             # configuration section name, also used for --include/--exclude and file names
+    title = None            # display name
+    required_keys = []      # configuration values which must be present in the section
+
+    def __init__(self, config, cache, file_prefix='', local=False, incremental=False, workers=4, resume=False):
+        self.config = config
+        self.section = config[self.name]
+        self.cache = cache
+        self.file_prefix = file_prefix
+        self.local = local
+        self.incremental = incremental
+        self.workers = workers
+        self.resume = resume
+        self.checkpoint = None
+        self.cancel_event = threading.Event()
+
+        # optional time limit in seconds for the whole export, set with 'timeout' in the exchange section
+        self.timeout = None
+        if 'timeout' in self.section:
+            self.timeout = float(self.section['timeout'])
+
+    def log(self, message):
+        # progress output, replaced with a shared ProgressReport when exchanges are run by run_exports()
+        print(message)
+
+    def cancel(self):
+        # ask a running export to stop; it raises ExportCancelled at its next API request or stage
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise ExportCancelled("%s export cancelled" % self.title)
+
+    def cache_keys(self):
+        # names of the cache files used by this exchange
+        return []
+
+    def open_checkpoint(self):
+        # progress journal for this exchange's API download (see Checkpoint), opened when the first API download
+        # starts so that runs which only read cache files leave an interrupted download's checkpoint alone
+        if self.checkpoint == None:
+            self.checkpoint = Checkpoint('%s%s_checkpoint.jsonl' % (self.file_prefix, self.name), self.resume, self.incremental, self.log)
+        return self.checkpoint
+
+    def remove_checkpoint(self):
+        if self.checkpoint != None:
+            self.checkpoint.remove()
+            self.checkpoint = None
+
+    def close_checkpoint(self):
+        # called after fetch() whether or not it succeeded; a download which failed or was cancelled leaves its
+        # checkpoint on disk for --resume, but must not keep the file open (batch workers export many profiles)
+        if self.checkpoint != None:
+            self.checkpoint.close()
+            self.checkpoint = None
+
+    def create_transport(self, page_complete=None):
+        # resilient HTTP transport for this exchange's API requests (see Transport), caching completed pages in
+        # <prefix>response_cache/<name>/ if page_complete is given
+        ttl = float(self.config['files'].get('response_cache_ttl', default_response_cache_ttl)) if 'files' in self.config.sections() else default_response_cache_ttl
+        cache_dir = os.path.join('%sresponse_cache' % self.file_prefix, self.name) if ttl > 0 else None
+        retries = int(self.section.get('retries', default_retries))
+        return Transport(get_rate_limiter(self.config, self.name, self.cancel_event), retries, cache_dir, ttl, page_complete, self.log, self.name)
+
+    def create_client(self):
+        # import the connector module and return an API client
+        raise NotImplementedError
+
+    def fetch(self, client):
+        # return a dict of cache key -> data, from the API (storing it in the cache) or from the cache
+        raise NotImplementedError
+
+    def normalize(self, data, entries):
+        # append export records for fetched data to entries (a RecordStore or ExportWriter)
+        raise NotImplementedError
+
+    def output_filename(self):
+        return '%s%s_transactions.csv' % (self.file_prefix, self.name)
+
+    def check_config(self):
+        missing = [key for key in self.required_keys if key not in self.section]
+        if len(missing) > 0:
+            if len(self.required_keys) == 2:
+                values = "'%s' and '%s'" % tuple(self.required_keys)
+            else:
+                values = ', '.join("'%s'" % key for key in self.required_keys[:-1]) + ", and '%s'" % self.required_keys[-1]
+            raise ExportError("%s configuration requires %s values" % (self.title, values), 3)
+
+class CoinbaseExchange(ExchangeAdapter):
+    name = 'coinbase'
+    title = 'Coinbase'
+    required_keys = ['key', 'secret']
+
+    def cache_keys(self):
+        return ['coinbase_accounts']
+
+    def create_client(self):
+        from coinbase.wallet.client import Client as CoinbaseClient
+        self.log("Creating Coinbase client")
+        coinbase_client = CoinbaseClient(self.section['key'], self.section['secret'], base_api_uri=self.section.get('api_url'))
+        self.transport = self.create_transport(coinbase_page_complete)
+        self.transport.install(coinbase_client.session, self.workers)
+        return coinbase_client
+
+    def fetch(self, coinbase_client):
+        cache = self.cache
+        if self.local and cache.exists('coinbase_accounts'):
+            self.log("Reading Coinbase account details from %s" % cache.filename('coinbase_accounts'))
+            return { 'coinbase_accounts': cache.load('coinbase_accounts') }
+
+        cached_accounts = None
+        sync_marks = {}
+        if self.incremental and cache.exists('coinbase_accounts'):
+            self.log("Reading cached Coinbase account details from %s for incremental update" % cache.filename('coinbase_accounts'))
+            cached_accounts = cache.load('coinbase_accounts')
+            # only trust high-water marks for accounts which are actually present in the cache
+            cached_ids = set(account['id'] for account in cached_accounts['data'])
+            sync_marks = { account_id: marks for account_id, marks in load_sync_state('%scoinbase_sync.json' % self.file_prefix).items() if account_id in cached_ids }
+
+        self.log("Getting Coinbase account list via API (%d workers)" % self.workers)
+        coinbase_accounts = fetch_coinbase_accounts(coinbase_client, self.workers, sync_marks, self.log, self.open_checkpoint())
+        if cached_accounts != None:
+            coinbase_accounts = merge_coinbase_accounts(cached_accounts, coinbase_accounts)
+
+        self.log("Storing account data in %s" % cache.filename('coinbase_accounts'))
+        cache.store('coinbase_accounts', coinbase_accounts)
+        self.remove_checkpoint()
+        self.transport.clear_cache()
+
+        save_sync_state('%scoinbase_sync.json' % self.file_prefix, coinbase_sync_marks(coinbase_accounts))
+        return { 'coinbase_accounts': coinbase_accounts }
+
+    def normalize(self, data, coinbase_entries):
+        normalize_coinbase_accounts(data['coinbase_accounts'], coinbase_entries, self.log)
+        self.log("- Processed %d transactions for all accounts" % len(coinbase_entries))
+
+class GdaxExchange(ExchangeAdapter):
+    name = 'gdax'
+    title = 'GDAX'
+    required_keys = ['passphrase', 'key', 'secret']
+
+    def cache_keys(self):
+        return ['gdax_accounts', 'gdax_fills']
+
+    def create_client(self):
+        import gdax, requests
+        self.log("Creating authenticated GDAX client")
+        if 'api_url' in self.section:
+            gdax_auth_client = gdax.AuthenticatedClient(self.section['key'], self.section['secret'], self.section['passphrase'], api_url=self.section['api_url'])
+        else:
+            gdax_auth_client = gdax.AuthenticatedClient(self.section['key'], self.section['secret'], self.section['passphrase'])
+        # the client is only used for its URL and authentication, requests go through the transport session
+        self.transport = self.create_transport(gdax_page_complete)
+        self.session = self.transport.install(requests.Session(), self.workers)
+        return gdax_auth_client
+
+    def fetch(self, gdax_auth_client):
+        cache = self.cache
+        session = self.session
+        r, products = gdax_get(gdax_auth_client, session, '/products')
+        sync_state = load_sync_state('%sgdax_sync.json' % self.file_prefix)
+
+        if self.local and cache.exists('gdax_accounts'):
+            self.log("Reading GDAX account details from %s" % cache.filename('gdax_accounts'))
+            gdax_accounts = cache.load('gdax_accounts')
+            # the cached ledgers may predate the first trade of a product, so they can't tell which have no fills
+            held_currencies = None
+        else:
+            history_marks = {}
+            if self.incremental and cache.exists('gdax_accounts'):
+                self.log("Reading cached GDAX account details from %s for incremental update" % cache.filename('gdax_accounts'))
+                cached_history = { account['id']: account['history'] for account in cache.load('gdax_accounts') }
+                history_marks = { account_id: mark for account_id, mark in sync_state.get('history', {}).items() if account_id in cached_history }
+
+            self.log("Getting GDAX account list via API")
+            r, gdax_accounts = gdax_get(gdax_auth_client, session, '/accounts')
+            checkpoint = self.open_checkpoint()
+
+            self.log("- GDAX profile %s" % (gdax_accounts[0]['profile_id']))
+            for i, account in enumerate(gdax_accounts):
+                if account['id'] in history_marks:
+                    self.log("- #%d %s: %0.16f %s available (%0.16f %s on hold), getting account history after %s via API" % (i, account['id'], float(account['available']), account['currency'], float(account['hold']), account['currency'], history_marks[account['id']]))
+                    paginate = lambda before: paginate_gdax_newer(gdax_auth_client, session, '/accounts/%s/ledger' % account['id'], before)
+                    new_pages = fetch_pages(paginate, history_marks[account['id']], checkpoint, ['ledger', account['id']], { 'exchange': 'gdax', 'account': account['id'], 'endpoint': 'ledger' })
+                    gdax_accounts[i]['history'] = merge_pages(cached_history[account['id']], new_pages)
+                else:
+                    self.log("- #%d %s: %0.16f %s available (%0.16f %s on hold), getting account history via API" % (i, account['id'], float(account['available']), account['currency'], float(account['hold']), account['currency']))
+                    paginate = lambda after: paginate_gdax(gdax_auth_client, session, '/accounts/%s/ledger' % account['id'], {}, after)
+                    gdax_accounts[i]['history'] = fetch_pages(paginate, None, checkpoint, ['ledger', account['id']], { 'exchange': 'gdax', 'account': account['id'], 'endpoint': 'ledger' })
+
+            self.log("Storing account history in %s" % cache.filename('gdax_accounts'))
+            cache.store('gdax_accounts', gdax_accounts)
+            held_currencies = gdax_held_currencies(gdax_accounts)
+
+            sync_state['history'] = {}
+            for account in gdax_accounts:
+                history_mark = gdax_sync_mark(account['history'], 'id')
+                if history_mark != None:
+                    sync_state['history'][account['id']] = history_mark
+            save_sync_state('%sgdax_sync.json' % self.file_prefix, sync_state)
+
+        if self.local and cache.exists('gdax_fills'):
+            self.log("Reading GDAX fill details from %s" % cache.filename('gdax_fills'))
+            gdax_fills = cache.load('gdax_fills')
+        else:
+            cached_fills = None
+            fill_marks = {}
+            if self.incremental and cache.exists('gdax_fills'):
+                self.log("Reading cached GDAX fill details from %s for incremental update" % cache.filename('gdax_fills'))
+                cached_fills = cache.load('gdax_fills')
+                fill_marks = sync_state.get('fills', {})
+
+            self.log("Getting GDAX order fill history via API (%d workers)" % self.workers)
+            gdax_fills = fetch_gdax_fills(gdax_auth_client, session, self.workers, products, held_currencies, fill_marks, self.log, self.open_checkpoint())
+            if cached_fills != None:
+                gdax_fills = merge_pages(cached_fills, gdax_fills, key=lambda fill: (fill['product_id'], fill['trade_id']))
+
+            self.log("Storing fill history in %s" % cache.filename('gdax_fills'))
+            cache.store('gdax_fills', gdax_fills)
+
+            # trade IDs are only unique per product, so track a separate mark for each one
+            sync_state['fills'] = {}
+            for fill_page in gdax_fills:
+                for fill in fill_page:
+                    if fill['product_id'] not in sync_state['fills'] or fill['trade_id'] > sync_state['fills'][fill['product_id']]:
+                        sync_state['fills'][fill['product_id']] = fill['trade_id']
+            save_sync_state('%sgdax_sync.json' % self.file_prefix, sync_state)
+
+        # a checkpoint is only opened for an API download; a run which only read cache files leaves the pages of an
+        # interrupted download in the response cache, like a --local Coinbase run does
+        if self.checkpoint != None:
+            self.remove_checkpoint()
+            self.transport.clear_cache()
+        return { 'gdax_accounts': gdax_accounts, 'gdax_fills': gdax_fills }
+
+    def normalize(self, data, gdax_entries):
+        normalize_gdax_fills(data['gdax_fills'], gdax_entries)
+        gdax_fills_count = len(gdax_entries)
+        self.log("- Processed %d order fills for all accounts" % gdax_fills_count)
+
+        normalize_gdax_accounts(data['gdax_accounts'], gdax_entries)
+        gdax_transfers_count = len(gdax_entries) - gdax_fills_count
+        self.log("- Processed %d transfers for all accounts" % gdax_transfers_count)
+
+# exchange adapters shipped with this script, in job order
+builtin_exchanges = { 'coinbase': CoinbaseExchange, 'gdax': GdaxExchange }
+
+def exchange_entry_points():
+    # exchange adapters registered by other installed packages (name -> entry point, not loaded yet)
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return {}
+    found = entry_points()
+    if hasattr(found, 'select'):
+        found = found.select(group='crypto_export.exchanges')
+    else:
+        found = found.get('crypto_export.exchanges', [])
+    return { entry_point.name: entry_point for entry_point in found if entry_point.name not in builtin_exchanges }
+
+def supported_exchanges():
+    return list(builtin_exchanges) + sorted(exchange_entry_points())
+
+def load_exchange_adapter(name):
+    # adapter class for an exchange, importing plugin modules only when they are actually needed
+    if name in builtin_exchanges:
+        return builtin_exchanges[name]
+    entry_points = exchange_entry_points()
+    if name not in entry_points:
+        raise ExportError("Unsupported exchange '%s'" % name)
+    return entry_points[name].load()
+
+def export_exchange(adapter, sort_buffer=default_sort_buffer):
+    # run a complete export for one exchange: fetch (or read cached) data, normalize it and write the CSV file
+    adapter.check_config()
+    client = adapter.create_client()
+    try:
+        with metrics.timer('fetch', exchange=adapter.name):
+            data = adapter.fetch(client)
+    finally:
+        adapter.close_checkpoint()
+    adapter.check_cancelled()
+
+    entries = ExportWriter(adapter.output_filename(), sort_buffer, { 'exchange': adapter.name })
+    with metrics.timer('normalize', exchange=adapter.name):
+        adapter.normalize(data, entries)
+    adapter.log("- Total of %d records obtained from %s" % (len(entries), adapter.title))
+    metrics.count('exported_records', len(entries), exchange=adapter.name)
+    adapter.check_cancelled()
+
+    adapter.log("Writing %s" % adapter.output_filename())
+    entries.close()
+    return len(entries)
+
+class ProgressReport:
+    # single progress report for concurrently running exchange jobs: output lines are serialized and
+    # prefixed with the exchange name, and each job's outcome is collected for the final summary
+    def __init__(self, adapters):
+        self.lock = threading.Lock()
+        # one entry per job in queue order, filled in as jobs finish
+        self.results = [None] * len(adapters)
+        self.positions = dict((id(adapter), i) for i, adapter in enumerate(adapters))
+
+    def log(self, adapter, message):
+        with self.lock:
+            for line in str(message).split('\n'):
+                print("[%s] %s" % (adapter.title, line))
+
+    def add_result(self, adapter, status, records, elapsed):
+        with self.lock:
+            self.results[self.positions[id(adapter)]] = (adapter.title, status, records, elapsed)
+
+    def summary(self):
+        print("")
+        print("Export summary:")
+        for title, status, records, elapsed in self.results:
+            print("- %s: %s, %d records, %0.1f seconds" % (title, status, records, elapsed))
+
+async def run_export_job(adapter, executor, sort_buffer, report):
+    # run one exchange export in a worker thread, enforcing its timeout; returns an exit status
+    adapter.log = lambda message: report.log(adapter, message)
+    loop = asyncio.get_event_loop()
+    start = time.monotonic()
+    try:
+        records = await asyncio.wait_for(loop.run_in_executor(executor, export_exchange, adapter, sort_buffer), adapter.timeout)
+    except asyncio.TimeoutError:
+        adapter.cancel()
+        report.add_result(adapter, "timed out after %g seconds" % adapter.timeout, 0, time.monotonic() - start)
+        return 1
+    except asyncio.CancelledError:
+        adapter.cancel()
+        raise
+    except ExportError as e:
+        report.add_result(adapter, "failed: %s" % e, 0, time.monotonic() - start)
+        return e.status
+    except Exception as e:
+        report.log(adapter, traceback.format_exc().rstrip())
+        report.add_result(adapter, "failed: %s: %s" % (type(e).__name__, e), 0, time.monotonic() - start)
+        return 1
+    report.add_result(adapter, "ok", records, time.monotonic() - start)
+    return 0
+
+async def run_export_jobs(adapters, sort_buffer, report):
+    executor = ThreadPoolExecutor(max_workers=max(1, len(adapters)))
+    try:
+        statuses = await asyncio.gather(*[run_export_job(adapter, executor, sort_buffer, report) for adapter in adapters])
+    finally:
+        # timed out jobs stop at their next cancellation check, wait for that so no thread outlives the run
+        executor.shutdown(wait=True)
+    return max(statuses) if len(statuses) > 0 else 0
+
+def run_exports(adapters, sort_buffer=default_sort_buffer):
+    # run all queued exchange exports concurrently, so that a failure or timeout in one exchange doesn't
+    # stop the others; prints a summary and returns the highest exit status of all jobs (0 if all succeeded)
+    # along with the (title, status, records, elapsed) result of each job
+    report = ProgressReport(adapters)
+    # a fresh event loop for every run (asyncio.run() needs Python 3.7), since batch workers call this repeatedly
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        status = loop.run_until_complete(run_export_jobs(adapters, sort_buffer, report))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    report.summary()
+    return status, report.results
+
+def run_profiled(profiler, filename, function, *args):
+    # call function(*args) under cProfile or tracemalloc and print the top entries; cProfile statistics of all
+    # threads started during the call are merged and also saved to filename for later analysis with pstats
+    if profiler == 'tracemalloc':
+        tracemalloc.start(10)
+        try:
+            result = function(*args)
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        print("")
+        print("Peak traced memory: %0.1f MB, top allocations still held:" % (peak / 1e6))
+        for stat in snapshot.statistics('lineno')[:25]:
+            print(stat)
+        return result
+
+    thread_profiles = []
+    def profile_thread(frame, event, arg):
+        # first profiler event in a new thread: replace this hook with a profiler for the thread
+        sys.setprofile(None)
+        thread_profile = cProfile.Profile()
+        try:
+            thread_profile.enable()
+        except ValueError:
+            # Python 3.12+ only allows one active profiler, which already covers every thread
+            return
+        thread_profiles.append(thread_profile)
+
+    profile = cProfile.Profile()
+    threading.setprofile(profile_thread)
+    profile.enable()
+    try:
+        return function(*args)
+    finally:
+        profile.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(profile, *thread_profiles)
+        stats.dump_stats(filename)
+        print("")
+        print("Profile of %d threads saved to %s, top functions by cumulative time:" % (1 + len(thread_profiles), filename))
+        stats.sort_stats('cumulative').print_stats(25)
+
+class PrefixedOutput:
+    # stdout replacement for batch worker processes: output is written a whole line at a time, prefixed with
+    # the profile name, so lines from profiles running at the same time don't get mixed up
+    def __init__(self, stream, prefix):
+        self.stream = stream
+        self.prefix = prefix
+        self.buffer = ''
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            self.buffer = self.buffer + text
+            if '\n' in self.buffer:
+                lines = self.buffer.split('\n')
+                self.buffer = lines.pop()
+                self.stream.write(''.join('%s%s\n' % (self.prefix, line) for line in lines))
+                self.stream.flush()
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+def read_batch(path):
+    # configuration files of a batch run: every *.conf file in a directory, or the files listed in a manifest
+    # (one per line, relative to the manifest's directory, ignoring blank lines and # comments)
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.conf')]
+    config_filenames = []
+    with open(path, 'r') as infile:
+        for line in infile:
+            line = line.strip()
+            if line != '' and not line.startswith('#'):
+                config_filenames.append(os.path.join(os.path.dirname(path), line))
+    return config_filenames
+
+def create_rate_budgets(config_filenames, manager):
+    # shared token bucket state and lock for every API host and key used by the profiles of a batch run, sized by
+    # the rate limit settings of the first profile using it. They live in a multiprocessing manager, since its
+    # proxies can be passed to the worker processes with each profile on every platform and Python version
+    rate_budgets = {}
+    for config_filename in config_filenames:
+        config = configparser.ConfigParser()
+        config.read(config_filename)
+        for exchange in supported_exchanges():
+            if exchange in config.sections():
+                key = rate_budget_key(config, exchange)
+                if key not in rate_budgets:
+                    rate, burst = get_rate_limit(config, exchange)
+                    rate_budgets[key] = (manager.list([max(1, burst), time.monotonic()]), manager.Lock())
+    return rate_budgets
+
+def run_batch_profile(config_filename, args, rate_budgets={}):
+    # export one profile of a batch run in a worker process; returns (status, exchange results, elapsed, error,
+    # metrics records labeled with the profile name, and peak memory labeled with the worker process ID)
+    global batch_rate_budgets
+    batch_rate_budgets = rate_budgets
+    profile_name = os.path.splitext(os.path.basename(config_filename))[0]
+    sys.stdout = PrefixedOutput(sys.__stdout__, '[%s] ' % profile_name)
+    metrics.reset()
+    start = time.monotonic()
+    try:
+        status, results = export_profile(config_filename, args)
+        return status, results, time.monotonic() - start, None, metrics.records({ 'worker': os.getpid() }, profile=profile_name)
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        return 1, [], time.monotonic() - start, "%s: %s" % (type(e).__name__, e), metrics.records({ 'worker': os.getpid() }, profile=profile_name)
+    finally:
+        sys.stdout.flush()
+        sys.stdout = sys.__stdout__
+
+def merge_batch_metrics(profile_records):
+    # metrics records of all profiles of a batch run; each worker process reports its peak memory with every
+    # profile it exported, so only the highest (latest) value per worker is kept
+    records = []
+    peaks = {}
+    for record in (record for profile in profile_records for record in profile):
+        if record['type'] == 'gauge':
+            key = (record['name'], tuple(sorted(record['labels'].items())))
+            if key not in peaks or record['value'] > peaks[key]['value']:
+                peaks[key] = record
+        else:
+            records.append(record)
+    return records + list(peaks.values())
+
+def run_batch(args):
+    # export every profile of a batch across a pool of worker processes, then print a consolidated report;
+    # returns the highest exit status of all profiles (0 if all succeeded)
+    config_filenames = read_batch(args.batch)
+    print("Batch of %d profiles from %s (%d processes)" % (len(config_filenames), args.batch, args.processes))
+    if len(config_filenames) == 0:
+        return 1
+
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=args.processes) as executor:
+        rate_budgets = create_rate_budgets(config_filenames, manager)
+        futures = [executor.submit(run_batch_profile, config_filename, args, rate_budgets) for config_filename in config_filenames]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except Exception as e:
+                # the worker process died (BrokenProcessPool) or its result couldn't be sent back
+                outcomes.append((1, [], 0.0, "worker failed: %s: %s" % (type(e).__name__, e), []))
+
+    print("")
+    print("Batch summary:")
+    failed = 0
+    for config_filename, (status, results, elapsed, error, records) in zip(config_filenames, outcomes):
+        if status != 0:
+            failed = failed + 1
+        details = ', '.join("%s: %s, %d records" % (title, result, records) for title, result, records, job_elapsed in results)
+        if error != None:
+            details = error
+        print("- %s: %s (%s), %0.1f seconds" % (config_filename, "ok" if status == 0 else "failed with status %d" % status, details or "nothing exported", elapsed))
+    print("%d of %d profiles exported successfully" % (len(config_filenames) - failed, len(config_filenames)))
+
+    if args.metrics != None:
+        print("Writing metrics of all profiles to %s" % args.metrics)
+        write_metrics(args.metrics, merge_batch_metrics([outcome[4] for outcome in outcomes]), args.metrics_format)
+    return max(outcome[0] for outcome in outcomes)
+
+def export_profile(config_filename, args):
+    # export all queued exchanges of one configuration file using the command line options in args; returns the
+    # exit status and the result of each exchange job
+
+    # make sure configuration file exists
+    if not os.path.isfile(config_filename):
+        print("Cannot find config file '%s'" % config_filename)
+        return 1, []
+
+    # read configuration details
+    config = configparser.ConfigParser()
+    config.read(config_filename)
+
+    # get file prefix settings, if configured
+    file_prefix = ''
+    if 'files' in config.sections():
+        if 'prefix' in config['files']:
+            file_prefix = config['files']['prefix']
+    try:
+        cache = get_cache(config, file_prefix)
+    except ExportError as e:
+        print(e)
+        return e.status, []
+
+    # maximum number of export records sorted in memory before spilling to temporary files
+    sort_buffer = default_sort_buffer
+    if 'files' in config.sections() and 'sort_buffer' in config['files']:
+        sort_buffer = int(config['files']['sort_buffer'])
+
+    # find all defined exchanges that we care about
+    exchanges = supported_exchanges()
+    print("Supported exchanges: %s" % exchanges)
+    print("Whitelisted exchanges: %s" % args.include)
+    print("Blacklisted exchanges: %s" % args.exclude)
+    defined_exchanges = []
+    queued_exchanges = []
+    for exchange in exchanges:
+        # skip if we have a whitelist and this isn't on it
+        if args.include != None and exchange not in args.include:
+            print("Skipping checks for '%s'" % exchange)
+            continue
+
+        print("Checking for '%s' definition in configuration file..." % exchange, end='')
+        if exchange in config.sections():
+            print("found")
+            defined_exchanges.append(exchange)
+        else:
+            print("not found")
+            if args.include != None and exchange in args.include:
+                print("Explicitly included exchange '%s' is not defined in config file" % exchange)
+                return 2, []
+            continue
+
+        if (args.exclude == None or exchange not in args.exclude) and (args.include == None or exchange in args.include):
+            queued_exchanges.append(exchange)
+
+    # load adapters for queued exchanges only, connector modules are imported when each job starts
+    print("Job list: %s" % ', '.join(queued_exchanges))
+    adapters = []
+    for exchange in queued_exchanges:
+        adapter_class = load_exchange_adapter(exchange)
+        adapters.append(adapter_class(config, cache, file_prefix, args.local, args.incremental, args.workers, args.resume))
+
+    # convert existing JSON cache files of queued exchanges to the configured cache backend, then stop
+    if args.convert_cache:
+        if isinstance(cache, JsonCache):
+            print("Cache backend is already 'json', nothing to convert")
+            return 1, []
+        json_cache = JsonCache(file_prefix)
+        for adapter in adapters:
+            for name in adapter.cache_keys():
+                if json_cache.exists(name):
+                    print("Converting %s to %s" % (json_cache.filename(name), cache.filename(name)))
+                    cache.store(name, json_cache.load(name))
+        return 0, []
+
+    if args.profile != None:
+        return run_profiled(args.profile, '%sprofile.pstats' % file_prefix, run_exports, adapters, sort_buffer)
+    return run_exports(adapters, sort_buffer)
+
+def main():
+    # welcome banner with script version
+    print("-------------------------------")
+    print("Crypto Export Script 20180215.0")
+    print("-------------------------------")
+    print("")
+
+    # define and parse command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", help="Configuration file, default is crypto_export.conf", default="crypto_export.conf")
+    parser.add_argument("-i", "--include", help="List of exchanges to include (whitelist) for this job", nargs="+")
+    parser.add_argument("-x", "--exclude", help="List of exchanges to exclude (blacklist) for this job", nargs="+")
+    parser.add_argument("-l", "--local", help="Use locally stored cache files if present", action="store_true")
+    parser.add_argument("-n", "--incremental", help="Only fetch records newer than the last run and merge them into the cache files", action="store_true")
+    parser.add_argument("-r", "--resume", help="Continue an interrupted API download from its checkpoint instead of starting over", action="store_true")
+    parser.add_argument("--convert-cache", help="Convert existing JSON cache files to the cache backend set in the config file and exit", action="store_true")
+    parser.add_argument("-w", "--workers", help="Number of concurrent API requests per exchange, default is 4", type=int, default=4)
+    parser.add_argument("-b", "--batch", help="Export every *.conf file in a directory, or every config file listed in a manifest file, instead of a single config file")
+    parser.add_argument("-p", "--processes", help="Number of profiles exported at the same time in batch mode, default is the number of CPUs", type=int, default=os.cpu_count())
+    parser.add_argument("-m", "--metrics", help="Write timings, request/page/record counts and peak memory of the run to this file")
+    parser.add_argument("--metrics-format", help="Format of the metrics file, 'jsonl' (default) or 'prometheus'", choices=metrics_formats, default='jsonl')
+    parser.add_argument("--profile", help="Run the export under 'cprofile' (statistics saved to profile.pstats) or 'tracemalloc'", choices=['cprofile', 'tracemalloc'])
+    args = parser.parse_args()
+
+    if args.batch != None:
+        status = run_batch(args)
+    else:
+        status, results = export_profile(args.config, args)
+        if args.metrics != None:
+            print("Writing metrics to %s" % args.metrics)
+            write_metrics(args.metrics, metrics.records(), args.metrics_format)
+    if status != 0:
+        sys.exit(status)
 
-    with open('%sgdax_transactions.csv' % file_prefix, 'w') as outfile:
-        outfile.write('Trade date,Buy amount,Buy currency,Sell amount,Sell currency,Fee amount,Fee currency,Trade ID,Comment,Type\n')
-        for row in sorted(gdax_entries, key=lambda row: row[0]):
-            outfile.write('%s\n' % ','.join(['%s' % x for x in row]))
+if __name__ == '__main__':
+    main()